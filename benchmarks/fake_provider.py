@@ -0,0 +1,119 @@
+"""
+Local stand-in for the OpenAI and Ollama APIs, for load tests.
+
+Serves `/v1/models`, `/api/tags` and `/v1/chat/completions`. Completions
+answer after `--latency` seconds with `--tokens` tokens, streamed as SSE at
+`--token-rate` tokens per second (0 streams them as fast as possible).
+
+Usage: python -m benchmarks.fake_provider [--port 9500] [--latency 0.02]
+       [--token-rate 1000] [--tokens 50]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+OPENAI_MODEL = "gpt-bench"
+OLLAMA_MODEL = "llama-bench"
+TOKENS = [" the", " quick", " brown", " fox", " jumps", " over", " a", " lazy", " dog."]
+
+
+def chunk(model: str, content=None, finish_reason=None) -> bytes:
+    message = {
+        "id": f"chatcmpl-{uuid.uuid4()}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"content": content} if content is not None else {},
+                "logprobs": None,
+                "finish_reason": finish_reason,
+            }
+        ],
+    }
+    return f"data: {json.dumps(message)}\n\n".encode()
+
+
+def create_app(latency: float, token_rate: float, tokens: int) -> web.Application:
+    delay = 1 / token_rate if token_rate else 0
+
+    async def models(request: web.Request):
+        return web.json_response(
+            {"object": "list", "data": [{"id": OPENAI_MODEL, "object": "model"}]}
+        )
+
+    async def tags(request: web.Request):
+        return web.json_response(
+            {"models": [{"model": OLLAMA_MODEL, "name": OLLAMA_MODEL}]}
+        )
+
+    async def chat_completions(request: web.Request):
+        body = await request.json()
+        model = body.get("model", OPENAI_MODEL)
+        words = [TOKENS[i % len(TOKENS)] for i in range(tokens)]
+        await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            if delay:
+                await asyncio.sleep(delay * tokens)
+            return web.json_response(
+                {
+                    "id": f"chatcmpl-{uuid.uuid4()}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": "".join(words)},
+                            "logprobs": None,
+                            "finish_reason": "stop",
+                        }
+                    ],
+                }
+            )
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in words:
+            if delay:
+                await asyncio.sleep(delay)
+            await response.write(chunk(model, word))
+        await response.write(chunk(model, finish_reason="stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/v1/models", models)
+    app.router.add_get("/api/tags", tags)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9500)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--token-rate", type=float, default=1000)
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(args.latency, args.token_rate, args.tokens),
+        host=args.host,
+        port=args.port,
+        print=None,
+        access_log=None,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+Load test of the server against a local fake provider.
+
+Starts `benchmarks.fake_provider` and `uvicorn main:app` with the OpenAI and
+Ollama manifolds and the conversation turn limit filter from `examples/`
+pointed at it. It then drives each scenario at each concurrency level:
+
+- streaming and non-streaming `/v1/chat/completions` (OpenAI manifold)
+- streaming `/v1/chat/completions` (Ollama manifold)
+- the filter's `/filter/inlet` and `/filter/outlet`
+
+For each run it reports requests per second, p50/p95/p99 latency, p50/p95
+time to first chunk (streams only) and server CPU milliseconds per request.
+CPU is read from /proc, so it is only reported on Linux.
+
+With `--baseline` each run is compared to a recorded one. The script exits
+with status 1 when throughput drops or p50/p95 latency, p50 time to first
+chunk or CPU per request grows by more than `--tolerance` (default 50%).
+Absolute numbers depend on the machine, so record the baseline with `--save`
+on the machine that runs the check.
+
+Usage: python -m benchmarks.load_test [--concurrency 1 8 32] [--requests 200]
+       [--baseline benchmarks/baseline.json] [--save results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+API_KEY = "bench-key"
+PIPELINES = {
+    "openai_manifold_pipeline": "examples/pipelines/providers/openai_manifold_pipeline.py",
+    "ollama_manifold_pipeline": "examples/pipelines/providers/ollama_manifold_pipeline.py",
+    "conversation_turn_limit_filter": "examples/filters/conversation_turn_limit_filter.py",
+}
+OPENAI_MODEL = "openai_manifold_pipeline.gpt-bench"
+OLLAMA_MODEL = "ollama_manifold_pipeline.llama-bench"
+FILTER = "conversation_turn_limit_filter"
+
+MESSAGES = [{"role": "user", "content": "Tell me about foxes."}]
+USER = {"id": "bench", "name": "Bench", "role": "user"}
+
+# name -> (path, body, streamed)
+SCENARIOS = {
+    "chat_stream": (
+        "/v1/chat/completions",
+        {"model": OPENAI_MODEL, "messages": MESSAGES, "stream": True},
+        True,
+    ),
+    "chat": (
+        "/v1/chat/completions",
+        {"model": OPENAI_MODEL, "messages": MESSAGES, "stream": False},
+        False,
+    ),
+    "ollama_stream": (
+        "/v1/chat/completions",
+        {"model": OLLAMA_MODEL, "messages": MESSAGES, "stream": True},
+        True,
+    ),
+    "filter_inlet": (
+        f"/{FILTER}/filter/inlet",
+        {"body": {"model": OPENAI_MODEL, "messages": MESSAGES}, "user": USER},
+        False,
+    ),
+    "filter_outlet": (
+        f"/{FILTER}/filter/outlet",
+        {"body": {"model": OPENAI_MODEL, "messages": MESSAGES}, "user": USER},
+        False,
+    ),
+}
+
+METRICS = [
+    "rps",
+    "p50_ms",
+    "p95_ms",
+    "p99_ms",
+    "ttft_p50_ms",
+    "ttft_p95_ms",
+    "cpu_ms_per_request",
+]
+# Metrics compared to the baseline -> True if higher is better. The p99 and
+# the p95 of time to first chunk rest on a handful of samples per run, too
+# few to gate on, so they are only reported.
+CHECKS = {
+    "rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "ttft_p50_ms": False,
+    "cpu_ms_per_request": False,
+}
+
+
+def cpu_seconds(pid: int):
+    # utime + stime of a process, or None where /proc is not available
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rpartition(")")[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def percentile(values, p: int):
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def prepare_pipelines(directory: str, provider_url: str):
+    for module_name, path in PIPELINES.items():
+        shutil.copy(os.path.join(ROOT, path), directory)
+
+    # The OpenAI base URL is a valve, not an environment variable
+    valves_dir = os.path.join(directory, "openai_manifold_pipeline")
+    os.makedirs(valves_dir, exist_ok=True)
+    with open(os.path.join(valves_dir, "valves.json"), "w") as f:
+        json.dump(
+            {"OPENAI_API_BASE_URL": f"{provider_url}/v1", "OPENAI_API_KEY": "bench"},
+            f,
+        )
+
+
+async def wait_for_models(session: aiohttp.ClientSession, url: str, timeout: float):
+    # Manifold models are discovered in the background after startup
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{url}/models") as response:
+                if response.status == 200:
+                    models = {model["id"] for model in (await response.json())["data"]}
+                    if {OPENAI_MODEL, OLLAMA_MODEL, FILTER} <= models:
+                        return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Timed out waiting for the pipelines to be ready")
+
+
+async def request(
+    session: aiohttp.ClientSession, url: str, body: dict, streamed: bool
+) -> tuple:
+    start_time = time.perf_counter()
+    ttft = None
+    async with session.post(url, json=body) as response:
+        if streamed:
+            async for data in response.content.iter_any():
+                if ttft is None and data:
+                    ttft = time.perf_counter() - start_time
+        else:
+            await response.read()
+        ok = response.status == 200
+    return ok, time.perf_counter() - start_time, ttft
+
+
+async def run_scenario(
+    url: str, name: str, concurrency: int, requests: int, server_pid: int
+) -> dict:
+    path, body, streamed = SCENARIOS[name]
+    latencies = []
+    ttfts = []
+    errors = 0
+    remaining = requests
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    headers = {"Authorization": f"Bearer {API_KEY}"}
+    async with aiohttp.ClientSession(connector=connector, headers=headers) as session:
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                try:
+                    ok, latency, ttft = await request(
+                        session, f"{url}{path}", body, streamed
+                    )
+                except aiohttp.ClientError:
+                    ok, latency, ttft = False, None, None
+                if not ok:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        cpu_start = cpu_seconds(server_pid)
+        start_time = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start_time
+        cpu_end = cpu_seconds(server_pid)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "ttft_p50_ms": ms(percentile(ttfts, 50)) if streamed else None,
+        "ttft_p95_ms": ms(percentile(ttfts, 95)) if streamed else None,
+        "cpu_ms_per_request": (
+            ms((cpu_end - cpu_start) / requests) if cpu_start is not None else None
+        ),
+    }
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    recorded = {(run["scenario"], run["concurrency"]): run for run in baseline}
+    regressions = []
+    for run in results:
+        base = recorded.get((run["scenario"], run["concurrency"]))
+        if base is None:
+            continue
+        for metric, higher_is_better in CHECKS.items():
+            value, expected = run.get(metric), base.get(metric)
+            if value is None or not expected:
+                continue
+            change = (value - expected) / expected
+            if (higher_is_better and change < -tolerance) or (
+                not higher_is_better and change > tolerance
+            ):
+                regressions.append(
+                    f"{run['scenario']} x{run['concurrency']} {metric}: "
+                    f"{expected} -> {value} ({change:+.0%})"
+                )
+        if run["errors"] > base.get("errors", 0):
+            regressions.append(
+                f"{run['scenario']} x{run['concurrency']} errors: "
+                f"{base.get('errors', 0)} -> {run['errors']}"
+            )
+    return regressions
+
+
+def print_results(results: list):
+    columns = ["scenario", "concurrency", "errors", *METRICS]
+    widths = [max(len(column), 14) for column in columns]
+    print("  ".join(column.rjust(width) for column, width in zip(columns, widths)))
+    for run in results:
+        print(
+            "  ".join(
+                str("-" if run[column] is None else run[column]).rjust(width)
+                for column, width in zip(columns, widths)
+            )
+        )
+
+
+async def run(args) -> list:
+    provider_url = f"http://127.0.0.1:{args.provider_port}"
+    url = f"http://127.0.0.1:{args.port}"
+    directory = tempfile.mkdtemp(prefix="pipelines-bench-")
+    log = open(os.path.join(directory, "server.log"), "w")
+    prepare_pipelines(directory, provider_url)
+
+    provider = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.fake_provider",
+            "--port",
+            str(args.provider_port),
+            "--latency",
+            str(args.latency),
+            "--token-rate",
+            str(args.token_rate),
+            "--tokens",
+            str(args.tokens),
+        ],
+        cwd=ROOT,
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(args.port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+        env={
+            **os.environ,
+            "PIPELINES_DIR": directory,
+            "PIPELINES_API_KEY": API_KEY,
+            "OLLAMA_BASE_URL": provider_url,
+            # Concurrent requests are identical; each must reach the provider
+            "PIPELINES_COALESCE": "false",
+        },
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_for_models(session, url, args.startup_timeout)
+
+        results = []
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                # Warm up connections and caches outside the measurement
+                await run_scenario(url, name, concurrency, concurrency, server.pid)
+                result = await run_scenario(
+                    url, name, concurrency, args.requests, server.pid
+                )
+                print(
+                    f"{name} x{concurrency}: {result['rps']} req/s, "
+                    f"p95 {result['p95_ms']} ms",
+                    file=sys.stderr,
+                )
+                results.append(result)
+        return results
+    finally:
+        for process in (server, provider):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument("--port", type=int, default=9400)
+    parser.add_argument("--provider-port", type=int, default=9500)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--token-rate", type=float, default=1000)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--baseline", help="results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--save", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark for the streamed chunk encoder.
+
+Compares building a fresh `stream_message_template` dict and `json.dumps` per
+chunk (the previous streaming path) with `StreamMessageEncoder.encode`.
+
+Usage: python -m benchmarks.sse_encoder [--chunks N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.pipelines.main import stream_message_template
+from utils.pipelines.stream import StreamMessageEncoder
+
+MODEL = "openai_manifold_pipeline.gpt-4o"
+CHUNKS = [" the", " quick", ' "brown"', " fox\n", " jumps", " über", " 🦊", " dog."]
+
+
+def template_path(n: int):
+    for i in range(n):
+        message = stream_message_template(MODEL, CHUNKS[i % len(CHUNKS)])
+        yield f"data: {json.dumps(message)}\n\n"
+
+
+def encoder_path(n: int):
+    encoder = StreamMessageEncoder(MODEL)
+    for i in range(n):
+        yield encoder.encode(CHUNKS[i % len(CHUNKS)])
+
+
+def run(name, path, n):
+    start = time.perf_counter()
+    for _ in path(n):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24}{n / elapsed:>14,.0f} chunks/s")
+    return n / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=200_000)
+    args = parser.parse_args()
+
+    # Same output modulo the per-chunk id and timestamp
+    encoder = StreamMessageEncoder(MODEL)
+    for chunk in CHUNKS:
+        message = stream_message_template(MODEL, chunk)
+        message["id"], message["created"] = encoder.id, encoder.created
+        assert encoder.encode(chunk) == f"data: {json.dumps(message)}\n\n"
+
+    before = run("stream_message_template", template_path, args.chunks)
+    after = run("StreamMessageEncoder", encoder_path, args.chunks)
+    print(f"{'speedup':<24}{after / before:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main()
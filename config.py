@@ -13,3 +13,69 @@ except ImportError:
 
 API_KEY = os.getenv("PIPELINES_API_KEY", "0p3n-w3bu!")
 PIPELINES_DIR = os.getenv("PIPELINES_DIR", "./pipelines")
+
+# Reload pipelines automatically when files in PIPELINES_DIR change
+PIPELINES_WATCH = os.getenv("PIPELINES_WATCH", "false").lower() == "true"
+
+# Pipelines are imported on this many threads at boot and reload
+LOAD_WORKERS = int(
+    os.getenv("PIPELINES_LOAD_WORKERS", str(min(32, (os.cpu_count() or 1) + 4)))
+)
+
+# Per-pipeline limits in seconds for importing a file and for its on_startup hook (0 disables)
+LOAD_TIMEOUT = float(os.getenv("PIPELINES_LOAD_TIMEOUT", "300")) or None
+STARTUP_TIMEOUT = float(os.getenv("PIPELINES_STARTUP_TIMEOUT", "300")) or None
+
+# Seconds before a manifold's model list is refreshed in the background
+MODELS_TTL = float(os.getenv("PIPELINES_MODELS_TTL", "300"))
+
+# Per-manifold limit in seconds for one model discovery call (0 disables)
+DISCOVERY_TIMEOUT = float(os.getenv("PIPELINES_DISCOVERY_TIMEOUT", "30")) or None
+
+# Seconds between checks for changes made through other worker processes (0 disables)
+SYNC_INTERVAL = float(os.getenv("PIPELINES_SYNC_INTERVAL", "1"))
+
+# Completion requests that may run at once, server-wide and per pipeline (0 means unlimited),
+# and how many more may wait for a slot; pipelines can override with max_concurrency/max_queue
+MAX_CONCURRENCY = int(os.getenv("PIPELINES_MAX_CONCURRENCY", "0"))
+MAX_QUEUE = int(os.getenv("PIPELINES_MAX_QUEUE", "100"))
+PIPELINE_MAX_CONCURRENCY = int(os.getenv("PIPELINES_PIPELINE_MAX_CONCURRENCY", "0"))
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINES_PIPELINE_MAX_QUEUE", "100"))
+
+# Seconds a queued completion request may wait for a slot before it is rejected (0 disables)
+QUEUE_TIMEOUT = float(os.getenv("PIPELINES_QUEUE_TIMEOUT", "30")) or None
+
+# Memory cap of the response cache of pipelines that set cache_ttl
+CACHE_MAX_BYTES = int(os.getenv("PIPELINES_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Directory that cache entries evicted from memory spill to (empty disables), and its cap
+CACHE_DIR = os.getenv("PIPELINES_CACHE_DIR", "")
+CACHE_DISK_MAX_BYTES = int(
+    os.getenv("PIPELINES_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024))
+)
+
+# Semantic cache of pipelines that set semantic_cache: local embedding model, minimum cosine
+# similarity of a hit, and the number of answers kept across all models
+SEMANTIC_CACHE_MODEL = os.getenv(
+    "PIPELINES_SEMANTIC_CACHE_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
+)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("PIPELINES_SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(
+    os.getenv("PIPELINES_SEMANTIC_CACHE_MAX_ENTRIES", "10000")
+)
+
+# Let identical concurrent completion requests with temperature 0 share one run of the pipe;
+# pipelines can override this with a coalesce attribute
+COALESCE = os.getenv("PIPELINES_COALESCE", "false").lower() == "true"
+
+# Shared HTTP clients injected into pipelines as self.http: connections kept per upstream
+# origin, connect and read timeouts in seconds, and how long async clients cache DNS lookups
+HTTP_POOL_SIZE = int(os.getenv("PIPELINES_HTTP_POOL_SIZE", "100"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("PIPELINES_HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("PIPELINES_HTTP_READ_TIMEOUT", "300"))
+HTTP_DNS_TTL = int(os.getenv("PIPELINES_HTTP_DNS_TTL", "300"))
+
+# Where request tracing spans are exported: file:<path> (JSON lines) or otlp:<collector url> (empty disables)
+TRACING_EXPORTER = os.getenv("PIPELINES_TRACING_EXPORTER", "")
+
+# Number of chunks a streaming pipe may produce ahead of the client
+STREAM_QUEUE_SIZE = int(os.getenv("PIPELINES_STREAM_QUEUE_SIZE", "64"))
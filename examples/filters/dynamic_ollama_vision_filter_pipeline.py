@@ -11,7 +11,6 @@ requirements: pydantic, aiohttp
 from typing import List, Optional
 from pydantic import BaseModel
 import json
-import aiohttp
 from utils.pipelines.main import get_last_user_message
 
 class Pipeline:
@@ -52,17 +51,16 @@ class Pipeline:
             ]
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                if response.status == 200:
-                    content = []
-                    async for line in response.content:
-                        data = json.loads(line)
-                        content.append(data.get("message", {}).get("content", ""))
-                    return "".join(content)
-                else:
-                    print(f"Failed to process images with LLava, status code: {response.status}")
-                    return ""
+        async with self.http.async_session(url).post(url, json=payload) as response:
+            if response.status == 200:
+                content = []
+                async for line in response.content:
+                    data = json.loads(line)
+                    content.append(data.get("message", {}).get("content", ""))
+                return "".join(content)
+            else:
+                print(f"Failed to process images with LLava, status code: {response.status}")
+                return ""
 
     async def inlet(self, body: dict, user: Optional[dict] = None) -> dict:
         print(f"pipe:{__name__}")
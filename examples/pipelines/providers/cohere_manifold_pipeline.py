@@ -14,7 +14,6 @@ import json
 from schemas import OpenAIChatMessage
 from typing import List, Union, Generator, Iterator
 from pydantic import BaseModel
-import requests
 
 
 class Pipeline:
@@ -38,7 +37,7 @@ class Pipeline:
             **{"COHERE_API_KEY": os.getenv("COHERE_API_KEY", "your-api-key-here")}
         )
 
-        self.pipelines = self.get_cohere_models()
+        self.pipelines = []
 
     async def on_startup(self):
         print(f"on_startup:{__name__}")
@@ -51,10 +50,11 @@ class Pipeline:
     async def on_valves_updated(self):
         # This function is called when the valves are updated.
 
-        self.pipelines = self.get_cohere_models()
-
         pass
 
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_cohere_models()
+
     def get_cohere_models(self):
         if self.valves.COHERE_API_KEY:
             try:
@@ -62,7 +62,7 @@ class Pipeline:
                 headers["Authorization"] = f"Bearer {self.valves.COHERE_API_KEY}"
                 headers["Content-Type"] = "application/json"
 
-                r = requests.get(
+                r = self.http.session(self.valves.COHERE_API_BASE_URL).get(
                     f"{self.valves.COHERE_API_BASE_URL}/models", headers=headers
                 )
 
@@ -79,7 +79,7 @@ class Pipeline:
                 print(f"Error: {e}")
                 return [
                     {
-                        "id": self.id,
+                        "id": "error",
                         "name": "Could not fetch models from Cohere, please update the API Key in the valves.",
                     },
                 ]
@@ -105,7 +105,7 @@ class Pipeline:
         headers["Authorization"] = f"Bearer {self.valves.COHERE_API_KEY}"
         headers["Content-Type"] = "application/json"
 
-        r = requests.post(
+        r = self.http.session(self.valves.COHERE_API_BASE_URL).post(
             url=f"{self.valves.COHERE_API_BASE_URL}/chat",
             json={
                 "model": model_id,
@@ -141,7 +141,7 @@ class Pipeline:
         headers["Authorization"] = f"Bearer {self.valves.COHERE_API_KEY}"
         headers["Content-Type"] = "application/json"
 
-        r = requests.post(
+        r = self.http.session(self.valves.COHERE_API_BASE_URL).post(
             url=f"{self.valves.COHERE_API_BASE_URL}/chat",
             json={
                 "model": model_id,
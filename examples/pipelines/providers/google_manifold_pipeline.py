@@ -35,7 +35,6 @@ class Pipeline:
         self.pipelines = []
 
         genai.configure(api_key=self.valves.GOOGLE_API_KEY)
-        self.update_pipelines()
 
     async def on_startup(self) -> None:
         """This function is called when the server is started."""
@@ -52,7 +51,10 @@ class Pipeline:
 
         print(f"on_valves_updated:{__name__}")
         genai.configure(api_key=self.valves.GOOGLE_API_KEY)
+
+    def discover_pipelines(self) -> List[dict]:
         self.update_pipelines()
+        return self.pipelines
 
     def update_pipelines(self) -> None:
         """Update the available models from Google GenAI"""
@@ -29,7 +29,7 @@ class Pipeline:
             }
         )
 
-        self.pipelines = self.get_models()
+        self.pipelines = []
         pass
 
     async def on_startup(self):
@@ -45,9 +45,11 @@ class Pipeline:
     async def on_valves_updated(self):
         # This function is called when the valves are updated.
         print(f"on_valves_updated:{__name__}")
-        self.pipelines = self.get_models()
         pass
 
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_models()
+
     def get_models(self):
         if self.valves.GROQ_API_KEY:
             try:
@@ -10,7 +10,6 @@ description: A manifold pipeline that uses LiteLLM.
 from typing import List, Union, Generator, Iterator
 from schemas import OpenAIChatMessage
 from pydantic import BaseModel
-import requests
 import os
 
 
@@ -62,9 +61,11 @@ class Pipeline:
     async def on_valves_updated(self):
         # This function is called when the valves are updated.
 
-        self.pipelines = self.get_litellm_models()
         pass
 
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_litellm_models()
+
     def get_litellm_models(self):
 
         headers = {}
@@ -73,7 +74,7 @@ class Pipeline:
 
         if self.valves.LITELLM_BASE_URL:
             try:
-                r = requests.get(
+                r = self.http.session(self.valves.LITELLM_BASE_URL).get(
                     f"{self.valves.LITELLM_BASE_URL}/v1/models", headers=headers
                 )
                 models = r.json()
@@ -114,7 +115,7 @@ class Pipeline:
             payload.pop("user", None)
             payload.pop("title", None)
 
-            r = requests.post(
+            r = self.http.session(self.valves.LITELLM_BASE_URL).post(
                 url=f"{self.valves.LITELLM_BASE_URL}/v1/chat/completions",
                 json=payload,
                 headers=headers,
@@ -12,7 +12,6 @@ environment_variables: MLX_HOST, MLX_PORT, MLX_SUBPROCESS
 from typing import List, Union, Generator, Iterator
 from schemas import OpenAIChatMessage
 from pydantic import BaseModel
-import requests
 import os
 import subprocess
 import logging
@@ -102,7 +101,7 @@ class Pipeline:
         }
 
         try:
-            r = requests.post(
+            r = self.http.session(url).post(
                 url, headers=headers, json=payload, stream=body.get("stream", False)
             )
             r.raise_for_status()
@@ -3,7 +3,6 @@ from schemas import OpenAIChatMessage
 import os
 
 from pydantic import BaseModel
-import requests
 
 
 class Pipeline:
@@ -37,7 +36,6 @@ class Pipeline:
     async def on_startup(self):
         # This function is called when the server is started.
         print(f"on_startup:{__name__}")
-        self.pipelines = self.get_ollama_models()
         pass
 
     async def on_shutdown(self):
@@ -48,13 +46,17 @@ class Pipeline:
     async def on_valves_updated(self):
         # This function is called when the valves are updated.
         print(f"on_valves_updated:{__name__}")
-        self.pipelines = self.get_ollama_models()
         pass
 
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_ollama_models()
+
     def get_ollama_models(self):
         if self.valves.OLLAMA_BASE_URL:
             try:
-                r = requests.get(f"{self.valves.OLLAMA_BASE_URL}/api/tags")
+                r = self.http.session(self.valves.OLLAMA_BASE_URL).get(
+                    f"{self.valves.OLLAMA_BASE_URL}/api/tags"
+                )
                 models = r.json()
                 return [
                     {"id": model["model"], "name": model["name"]}
@@ -83,7 +85,7 @@ class Pipeline:
             print("######################################")
 
         try:
-            r = requests.post(
+            r = self.http.session(self.valves.OLLAMA_BASE_URL).post(
                 url=f"{self.valves.OLLAMA_BASE_URL}/v1/chat/completions",
                 json={**body, "model": model_id},
                 stream=True,
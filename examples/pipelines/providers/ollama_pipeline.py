@@ -1,6 +1,7 @@
-from typing import List, Union, Generator, Iterator
+from typing import List, Optional, Union, Generator, Iterator
 from schemas import OpenAIChatMessage
 import requests
+import threading
 
 
 class Pipeline:
@@ -24,7 +25,12 @@ class Pipeline:
         pass
 
     def pipe(
-        self, user_message: str, model_id: str, messages: List[dict], body: dict
+        self,
+        user_message: str,
+        model_id: str,
+        messages: List[dict],
+        body: dict,
+        cancel_event: Optional[threading.Event] = None,
     ) -> Union[str, Generator, Iterator]:
         # This is where you can add your custom pipelines like RAG.
         print(f"pipe:{__name__}")
@@ -47,6 +53,10 @@ class Pipeline:
 
             r.raise_for_status()
 
+            # Abort the upstream request (and free Ollama) when the client stops the stream
+            if cancel_event:
+                cancel_event.add_callback(r.close)
+
             if body["stream"]:
                 return r.iter_lines()
             else:
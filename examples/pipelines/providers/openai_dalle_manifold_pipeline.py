@@ -27,7 +27,7 @@ class Pipeline:
             api_key=self.valves.OPENAI_API_KEY,
         )
 
-        self.pipelines = self.get_openai_assistants()
+        self.pipelines = []
 
     async def on_startup(self) -> None:
         """This function is called when the server is started."""
@@ -44,7 +44,9 @@ class Pipeline:
             base_url=self.valves.OPENAI_API_BASE_URL,
             api_key=self.valves.OPENAI_API_KEY,
         )
-        self.pipelines = self.get_openai_assistants()
+
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_openai_assistants()
 
     def get_openai_assistants(self) -> List[dict]:
         """Get the available ImageGen models from OpenAI
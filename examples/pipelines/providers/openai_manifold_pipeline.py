@@ -3,7 +3,6 @@ from schemas import OpenAIChatMessage
 from pydantic import BaseModel
 
 import os
-import requests
 
 
 class Pipeline:
@@ -29,7 +28,7 @@ class Pipeline:
             }
         )
 
-        self.pipelines = self.get_openai_models()
+        self.pipelines = []
         pass
 
     async def on_startup(self):
@@ -45,9 +44,11 @@ class Pipeline:
     async def on_valves_updated(self):
         # This function is called when the valves are updated.
         print(f"on_valves_updated:{__name__}")
-        self.pipelines = self.get_openai_models()
         pass
 
+    def discover_pipelines(self) -> List[dict]:
+        return self.get_openai_models()
+
     def get_openai_models(self):
         if self.valves.OPENAI_API_KEY:
             try:
@@ -55,7 +56,7 @@ class Pipeline:
                 headers["Authorization"] = f"Bearer {self.valves.OPENAI_API_KEY}"
                 headers["Content-Type"] = "application/json"
 
-                r = requests.get(
+                r = self.http.session(self.valves.OPENAI_API_BASE_URL).get(
                     f"{self.valves.OPENAI_API_BASE_URL}/models", headers=headers
                 )
 
@@ -106,7 +107,7 @@ class Pipeline:
         print(payload)
 
         try:
-            r = requests.post(
+            r = self.http.session(self.valves.OPENAI_API_BASE_URL).post(
                 url=f"{self.valves.OPENAI_API_BASE_URL}/chat/completions",
                 json=payload,
                 headers=headers,
@@ -42,6 +42,12 @@ class Pipeline:
         print(f"on_shutdown:{__name__}")
         pass
 
+    # If the models come from a provider, leave self.pipelines empty and fetch them here instead of in __init__.
+    # The server calls this in the background once the pipeline is ready, after valves updates and every PIPELINES_MODELS_TTL seconds,
+    # and keeps serving the last good list if it fails or times out.
+    # def discover_pipelines(self) -> List[dict]:
+    #     return [{"id": "pipeline-1", "name": "Pipeline 1"}]
+
     def pipe(
         self, user_message: str, model_id: str, messages: List[dict], body: dict
     ) -> Union[str, Generator, Iterator]:
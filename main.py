@@ -1,58 +1,146 @@
 from fastapi import FastAPI, Request, Depends, status, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.concurrency import run_in_threadpool
 
 
 from starlette.responses import StreamingResponse, Response
 from pydantic import BaseModel, ConfigDict
-from typing import List, Union, Generator, Iterator
+from typing import (
+    List,
+    Optional,
+    Union,
+    Generator,
+    Iterator,
+    AsyncGenerator,
+    AsyncIterator,
+)
 
 
 from utils.pipelines.auth import bearer_security, get_current_user
-from utils.pipelines.main import get_last_user_message, stream_message_template
+from utils.pipelines.main import get_last_user_message
 from utils.pipelines.misc import convert_to_raw_url
+from utils.pipelines.registry import PipelineRegistry
+from utils.pipelines.admission import AdmissionController, AdmissionMiddleware
+from utils.pipelines.executors import HookLoops, PipelineExecutors, run_in_executor
+from utils.pipelines import metrics
+from utils.pipelines.profiler import SamplingProfiler
+from utils.pipelines.model_cache import ModelListCache
+from utils.pipelines.response_cache import (
+    CachedCompletion,
+    ResponseCache,
+    collect_response,
+    collect_stream,
+)
+from utils.pipelines.semantic_cache import SemanticCache, get_scope
+from utils.pipelines.coalesce import Coalescer, get_coalesce_key
+from utils.pipelines.http_client import HTTPClients
+from utils.pipelines.serialization import FastJSONResponse, FastJSONRoute
+from utils.pipelines.sync import SharedGeneration, write_file_atomic
+from utils.pipelines.tracing import (
+    TRACER,
+    TracingMiddleware,
+    get_exporter,
+    trace_stream,
+)
+from utils.pipelines.stream import (
+    CancellationEvent,
+    iterate_in_thread,
+    iterate_with_cancel,
+    StreamMessageEncoder,
+    CompletionAggregator,
+)
 
 from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
-from schemas import FilterForm, OpenAIChatCompletionForm
+from schemas import FilterForm, FilterChainForm, OpenAIChatCompletionForm
 from urllib.parse import urlparse
 
 import shutil
-import aiohttp
+import anyio
+import asyncio
+import hashlib
 import os
 import importlib.util
+import inspect
 import logging
 import time
 import json
-import uuid
 import sys
 
 
-from config import API_KEY, PIPELINES_DIR
+from config import (
+    API_KEY,
+    PIPELINES_DIR,
+    PIPELINES_WATCH,
+    LOAD_WORKERS,
+    LOAD_TIMEOUT,
+    STARTUP_TIMEOUT,
+    MODELS_TTL,
+    DISCOVERY_TIMEOUT,
+    SYNC_INTERVAL,
+    MAX_CONCURRENCY,
+    MAX_QUEUE,
+    PIPELINE_MAX_CONCURRENCY,
+    PIPELINE_MAX_QUEUE,
+    QUEUE_TIMEOUT,
+    CACHE_MAX_BYTES,
+    CACHE_DIR,
+    CACHE_DISK_MAX_BYTES,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    COALESCE,
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_DNS_TTL,
+    TRACING_EXPORTER,
+    STREAM_QUEUE_SIZE,
+)
 
 if not os.path.exists(PIPELINES_DIR):
     os.makedirs(PIPELINES_DIR)
 
 
-PIPELINES = {}
 PIPELINE_MODULES = {}
 PIPELINE_NAMES = {}
+# module name -> {"id": pipeline id, "fingerprint": source + valves hash at load time}
+PIPELINE_FILES = {}
+# pipeline id (module name while loading) -> {"status": loading|starting|ready|failed, "load", "startup"}
+PIPELINE_STATES = {}
+
+RELOAD_LOCK = asyncio.Lock()
+PROFILE_LOCK = asyncio.Lock()
+# Bumped on every change made through the API, so the other worker processes reload too
+GENERATION = SharedGeneration(os.path.join(PIPELINES_DIR, ".generation"))
+STARTUP_COMPLETE = asyncio.Event()
+TRACER.exporter = get_exporter(TRACING_EXPORTER)
+LOADER_EXECUTOR = ThreadPoolExecutor(
+    max_workers=LOAD_WORKERS, thread_name_prefix="pipeline-loader"
+)
+# Module names whose import is still running on a loader thread, even past LOAD_TIMEOUT
+IMPORTING = set()
+# Lifecycle hooks run on their pipeline's own loop and thread, off the server's loop
+HOOK_LOOPS = HookLoops()
+
+
+def is_ready(pipeline_id) -> bool:
+    return PIPELINE_STATES.get(pipeline_id, {}).get("status") == "ready"
 
 
 def get_all_pipelines():
     pipelines = {}
-    for pipeline_id in PIPELINE_MODULES.keys():
+    # Pipelines load concurrently, so list them in file name order rather than load order
+    for pipeline_id in sorted(PIPELINE_MODULES.keys(), key=PIPELINE_NAMES.get):
+        # Pipelines still loading or starting are neither listed nor routable
+        if not is_ready(pipeline_id):
+            continue
+
         pipeline = PIPELINE_MODULES[pipeline_id]
 
         if hasattr(pipeline, "type"):
             if pipeline.type == "manifold":
-                manifold_pipelines = []
-
-                # Check if pipelines is a function or a list
-                if callable(pipeline.pipelines):
-                    manifold_pipelines = pipeline.pipelines()
-                else:
-                    manifold_pipelines = pipeline.pipelines
+                # Cached list; discovery runs in the background, never here
+                manifold_pipelines = MODEL_LISTS.get(pipeline_id, pipeline)
 
                 for p in manifold_pipelines:
                     manifold_pipeline_id = f'{pipeline_id}.{p["id"]}'
@@ -106,7 +194,175 @@ def get_all_pipelines():
     return pipelines
 
 
-async def load_module_from_path(module_name, module_path):
+# Read-only snapshot of get_all_pipelines(), rebuilt only when pipelines or valves change
+REGISTRY = PipelineRegistry(get_all_pipelines)
+
+# Manifold model lists, discovered in the background once ready and revalidated after MODELS_TTL seconds
+MODEL_LISTS = ModelListCache(
+    ttl=MODELS_TTL, timeout=DISCOVERY_TIMEOUT, on_change=REGISTRY.rebuild
+)
+
+
+# Bounds the completion requests running and queued, server-wide and per pipeline
+ADMISSION = AdmissionController(
+    limit=MAX_CONCURRENCY or None,
+    max_queue=MAX_QUEUE,
+    pipeline_limit=PIPELINE_MAX_CONCURRENCY or None,
+    pipeline_max_queue=PIPELINE_MAX_QUEUE,
+    timeout=QUEUE_TIMEOUT,
+)
+
+
+def collect_admission(field):
+    return lambda: [
+        ((scope,), gate.stats()[field])
+        for scope, gate in [
+            ("global", ADMISSION.gate),
+            *ADMISSION.pipeline_gates.items(),
+            *ADMISSION.model_gates.items(),
+        ]
+    ]
+
+
+metrics.Gauge(
+    "pipelines_admission_active",
+    "Completion requests running, per admission gate.",
+    ("scope",),
+    collect=collect_admission("active"),
+)
+metrics.Gauge(
+    "pipelines_admission_waiting",
+    "Completion requests queued for a slot, per admission gate.",
+    ("scope",),
+    collect=collect_admission("waiting"),
+)
+metrics.Counter(
+    "pipelines_admission_rejected_total",
+    "Completion requests rejected, per admission gate.",
+    ("scope",),
+    collect=collect_admission("rejected"),
+)
+metrics.Gauge(
+    "pipelines_threadpool_busy_threads",
+    "Worker threads of the default thread pool in use.",
+    collect=lambda: [
+        ((), anyio.to_thread.current_default_thread_limiter().borrowed_tokens)
+    ],
+)
+metrics.Gauge(
+    "pipelines_threadpool_queued_tasks",
+    "Tasks waiting for a worker thread of the default thread pool.",
+    collect=lambda: [
+        (
+            (),
+            anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting,
+        )
+    ],
+)
+
+# Dedicated thread pools for pipelines with a concurrency limit
+EXECUTORS = PipelineExecutors(default_limit=PIPELINE_MAX_CONCURRENCY or None)
+
+# Completions of pipelines that opt in with cache_ttl
+RESPONSE_CACHE = ResponseCache(
+    max_bytes=CACHE_MAX_BYTES,
+    directory=CACHE_DIR,
+    disk_max_bytes=CACHE_DISK_MAX_BYTES,
+)
+metrics.Gauge(
+    "pipelines_cache_bytes",
+    "Approximate memory held by the response cache.",
+    collect=lambda: [((), RESPONSE_CACHE.bytes)],
+)
+metrics.Gauge(
+    "pipelines_cache_entries",
+    "Completions held in memory by the response cache.",
+    collect=lambda: [((), len(RESPONSE_CACHE))],
+)
+metrics.Counter(
+    "pipelines_cache_evictions_total",
+    "Completions evicted from the response cache's memory.",
+    collect=lambda: [((), RESPONSE_CACHE.evictions)],
+)
+
+# Near-duplicate questions to pipelines that also set semantic_cache
+SEMANTIC_CACHE = SemanticCache(
+    model_name=SEMANTIC_CACHE_MODEL,
+    threshold=SEMANTIC_CACHE_THRESHOLD,
+    max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+)
+metrics.Gauge(
+    "pipelines_semantic_cache_entries",
+    "Answers held by the semantic cache.",
+    collect=lambda: [((), len(SEMANTIC_CACHE))],
+)
+metrics.Counter(
+    "pipelines_semantic_cache_evictions_total",
+    "Answers evicted from the semantic cache.",
+    collect=lambda: [((), SEMANTIC_CACHE.evictions)],
+)
+
+# Single-flight runs of identical concurrent completion requests
+COALESCER = Coalescer(maxsize=STREAM_QUEUE_SIZE)
+metrics.Gauge(
+    "pipelines_coalesce_in_flight",
+    "Distinct completion runs that identical requests can attach to.",
+    collect=lambda: [((), len(COALESCER))],
+)
+
+# Keep-alive HTTP clients shared by all pipelines (self.http), one pool per upstream origin
+HTTP_CLIENTS = HTTPClients(
+    pool_size=HTTP_POOL_SIZE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    dns_ttl=HTTP_DNS_TTL,
+)
+
+
+def collect_http(field):
+    return lambda: [
+        ((origin, client), client_stats[field])
+        for origin, stats in HTTP_CLIENTS.stats().items()
+        for client, client_stats in stats.items()
+    ]
+
+
+metrics.Counter(
+    "pipelines_http_requests_total",
+    "Requests sent through the shared HTTP clients, per upstream origin.",
+    ("origin", "client"),
+    collect=collect_http("requests"),
+)
+metrics.Counter(
+    "pipelines_http_connections_total",
+    "Connections opened by the shared HTTP clients, per upstream origin.",
+    ("origin", "client"),
+    collect=collect_http("connections"),
+)
+
+
+def get_target_pipeline(model_id):
+    # Manifold models ("manifold.model") are admitted under their manifold
+    if not model_id:
+        return None
+    pipeline_id = (
+        model_id if model_id in PIPELINE_MODULES else model_id.split(".", 1)[0]
+    )
+    pipeline = PIPELINE_MODULES.get(pipeline_id)
+    return (pipeline_id, pipeline) if pipeline else None
+
+
+def refresh_model_lists():
+    MODEL_LISTS.refresh_stale(
+        {
+            pipeline_id: pipeline
+            for pipeline_id, pipeline in PIPELINE_MODULES.items()
+            if is_ready(pipeline_id)
+        }
+    )
+
+
+def load_module_from_path(module_name, module_path):
     spec = importlib.util.spec_from_file_location(module_name, module_path)
     module = importlib.util.module_from_spec(spec)
 
@@ -131,95 +387,390 @@ async def load_module_from_path(module_name, module_path):
     return None
 
 
-async def load_modules_from_directory(directory):
-    global PIPELINE_MODULES
-    global PIPELINE_NAMES
-
-    for filename in os.listdir(directory):
-        if filename.endswith(".py"):
-            module_name = filename[:-3]  # Remove the .py extension
-            module_path = os.path.join(directory, filename)
-
-            # Create subfolder matching the filename without the .py extension
-            subfolder_path = os.path.join(directory, module_name)
-            if not os.path.exists(subfolder_path):
-                os.makedirs(subfolder_path)
-                logging.info(f"Created subfolder: {subfolder_path}")
-
-            # Create a valves.json file if it doesn't exist
-            valves_json_path = os.path.join(subfolder_path, "valves.json")
-            if not os.path.exists(valves_json_path):
-                with open(valves_json_path, "w") as f:
-                    json.dump({}, f)
-                logging.info(f"Created valves.json in: {subfolder_path}")
-
-            pipeline = await load_module_from_path(module_name, module_path)
-            if pipeline:
-                # Overwrite pipeline.valves with values from valves.json
-                if os.path.exists(valves_json_path):
-                    with open(valves_json_path, "r") as f:
-                        valves_json = json.load(f)
-                        if hasattr(pipeline, "valves"):
-                            ValvesModel = pipeline.valves.__class__
-                            # Create a ValvesModel instance using default values and overwrite with valves_json
-                            combined_valves = {
-                                **pipeline.valves.model_dump(),
-                                **valves_json,
-                            }
-                            valves = ValvesModel(**combined_valves)
-                            pipeline.valves = valves
+def get_fingerprint(directory, module_name) -> dict:
+    # A source change restarts the pipeline; a valves.json change is applied in place
+    fingerprint = {}
+    for key, path in [
+        ("source", os.path.join(directory, f"{module_name}.py")),
+        ("valves", os.path.join(directory, module_name, "valves.json")),
+    ]:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                fingerprint[key] = hashlib.sha256(f.read()).hexdigest()
+        else:
+            fingerprint[key] = None
+    return fingerprint
 
-                            logging.info(f"Updated valves for module: {module_name}")
 
-                pipeline_id = pipeline.id if hasattr(pipeline, "id") else module_name
-                PIPELINE_MODULES[pipeline_id] = pipeline
-                PIPELINE_NAMES[pipeline_id] = module_name
-                logging.info(f"Loaded module: {module_name}")
-            else:
-                logging.warning(f"No Pipeline class found in {module_name}")
+def import_pipeline(directory, module_name):
+    # Runs on a loader thread: executes the module and builds its Pipeline with saved valves
+    module_path = os.path.join(directory, f"{module_name}.py")
 
-    global PIPELINES
-    PIPELINES = get_all_pipelines()
+    # Create subfolder matching the filename without the .py extension
+    subfolder_path = os.path.join(directory, module_name)
+    if not os.path.exists(subfolder_path):
+        os.makedirs(subfolder_path)
+        logging.info(f"Created subfolder: {subfolder_path}")
 
+    # Create a valves.json file if it doesn't exist
+    valves_json_path = os.path.join(subfolder_path, "valves.json")
+    if not os.path.exists(valves_json_path):
+        with open(valves_json_path, "w") as f:
+            json.dump({}, f)
+        logging.info(f"Created valves.json in: {subfolder_path}")
+
+    pipeline = load_module_from_path(module_name, module_path)
+    if pipeline:
+        # Pipelines that bring their own client keep it
+        if getattr(pipeline, "http", None) is None:
+            pipeline.http = HTTP_CLIENTS
+
+        # Overwrite pipeline.valves with values from valves.json
+        if os.path.exists(valves_json_path):
+            with open(valves_json_path, "r") as f:
+                valves_json = json.load(f)
+                if hasattr(pipeline, "valves"):
+                    ValvesModel = pipeline.valves.__class__
+                    # Create a ValvesModel instance using default values and overwrite with valves_json
+                    combined_valves = {
+                        **pipeline.valves.model_dump(),
+                        **valves_json,
+                    }
+                    valves = ValvesModel(**combined_valves)
+                    pipeline.valves = valves
 
-async def on_startup():
-    await load_modules_from_directory(PIPELINES_DIR)
+                    logging.info(f"Updated valves for module: {module_name}")
+
+    return pipeline
+
+
+def register_pipeline(directory, module_name, pipeline):
+    if pipeline:
+        pipeline_id = pipeline.id if hasattr(pipeline, "id") else module_name
+        PIPELINE_MODULES[pipeline_id] = pipeline
+        PIPELINE_NAMES[pipeline_id] = module_name
+        PIPELINE_FILES[module_name] = {
+            "id": pipeline_id,
+            "fingerprint": get_fingerprint(directory, module_name),
+        }
+        logging.info(f"Loaded module: {module_name}")
+        return pipeline_id
+    else:
+        logging.warning(f"No Pipeline class found in {module_name}")
+        return None
 
-    for module in PIPELINE_MODULES.values():
-        if hasattr(module, "on_startup"):
-            await module.on_startup()
+
+async def load_pipeline(directory, module_name):
+    """
+    Imports one pipeline file on a loader thread and registers it. A file that
+    fails or times out is marked failed without affecting the others. The
+    thread of a timed-out import cannot be stopped; the file stays in
+    IMPORTING until it returns, so that reloads do not import it again.
+    """
+    PIPELINE_STATES[module_name] = {
+        "status": "loading",
+        "module": module_name,
+        "load": None,
+        "startup": None,
+    }
+
+    start_time = time.perf_counter()
+    future = asyncio.get_running_loop().run_in_executor(
+        LOADER_EXECUTOR, import_pipeline, directory, module_name
+    )
+    IMPORTING.add(module_name)
+    future.add_done_callback(lambda _: IMPORTING.discard(module_name))
+    try:
+        # Shielded, so the future only completes when the thread does
+        pipeline = await asyncio.wait_for(asyncio.shield(future), timeout=LOAD_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"Timed out loading module: {module_name} after {LOAD_TIMEOUT}s")
+        pipeline = None
+    except Exception as e:
+        print(f"Error loading module: {module_name}")
+        print(e)
+        pipeline = None
+
+    state = PIPELINE_STATES.pop(module_name)
+    state["load"] = time.perf_counter() - start_time
+
+    pipeline_id = register_pipeline(directory, module_name, pipeline)
+    if pipeline_id:
+        PIPELINE_STATES[pipeline_id] = {**state, "status": "starting"}
+    else:
+        PIPELINE_STATES[module_name] = {**state, "status": "failed"}
+    return pipeline_id
+
+
+async def start_pipeline(pipeline_id) -> bool:
+    """
+    Runs the pipeline's `on_startup` hook on its hook loop under its own
+    timeout (`startup_timeout` on the pipeline, else PIPELINES_STARTUP_TIMEOUT)
+    and makes it routable once the hook returns. A hook that blocks, even an
+    `async def` one, neither stalls the server nor outlasts its timeout. A pipeline whose hook fails or
+    times out is dropped and retried on the next reload. With several worker
+    processes, each worker runs the hook of every pipeline.
+    """
+    pipeline = PIPELINE_MODULES[pipeline_id]
+    started = True
+
+    if hasattr(pipeline, "on_startup"):
+        timeout = getattr(pipeline, "startup_timeout", STARTUP_TIMEOUT)
+        start_time = time.perf_counter()
+        try:
+            await HOOK_LOOPS.run(pipeline_id, pipeline.on_startup, timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Timed out starting pipeline: {pipeline_id} after {timeout}s")
+            started = False
+        except Exception as e:
+            print(f"Error starting pipeline: {pipeline_id}")
+            print(e)
+            started = False
+        PIPELINE_STATES[pipeline_id]["startup"] = time.perf_counter() - start_time
+
+    PIPELINE_STATES[pipeline_id]["status"] = "ready" if started else "failed"
+    if started:
+        REGISTRY.rebuild()
+        refresh_model_lists()
+    else:
+        PIPELINE_FILES.pop(PIPELINE_NAMES.pop(pipeline_id), None)
+        PIPELINE_MODULES.pop(pipeline_id, None)
+        HOOK_LOOPS.discard(pipeline_id)
+    return started
+
+
+async def load_pipelines(directory, module_names) -> List[str]:
+    """
+    Loads and starts the given pipeline files concurrently. Each pipeline goes
+    loading -> starting -> ready (or failed) on its own, so a slow one never
+    holds back the others.
+    """
+
+    async def boot(module_name):
+        pipeline_id = await load_pipeline(directory, module_name)
+        if pipeline_id:
+            await start_pipeline(pipeline_id)
+        return pipeline_id or module_name
+
+    return await asyncio.gather(*[boot(module_name) for module_name in module_names])
+
+
+def print_startup_report(pipeline_ids: List[str]):
+    if not pipeline_ids:
+        return
+
+    print("Pipeline startup report:")
+    for pipeline_id in pipeline_ids:
+        state = PIPELINE_STATES[pipeline_id]
+        startup = state["startup"]
+        print(
+            f"  {pipeline_id:<40} {state['status']:<7}"
+            f" load {state['load']:7.2f}s"
+            f" startup {f'{startup:7.2f}s' if startup is not None else '      -'}"
+        )
+
+
+async def reload_valves(module_name):
+    # valves.json changed on disk (e.g. updated through another worker): apply it like /valves/update
+    loaded = PIPELINE_FILES[module_name]
+    loaded["fingerprint"] = get_fingerprint(PIPELINES_DIR, module_name)
+    pipeline = PIPELINE_MODULES[loaded["id"]]
+
+    valves_json_path = os.path.join(PIPELINES_DIR, module_name, "valves.json")
+    if not hasattr(pipeline, "valves") or not os.path.exists(valves_json_path):
+        return
+
+    try:
+        with open(valves_json_path, "r") as f:
+            valves_json = json.load(f)
+
+        ValvesModel = pipeline.valves.__class__
+        pipeline.valves = ValvesModel(**{**pipeline.valves.model_dump(), **valves_json})
+
+        if hasattr(pipeline, "on_valves_updated"):
+            await HOOK_LOOPS.run(loaded["id"], pipeline.on_valves_updated)
+
+        MODEL_LISTS.invalidate(loaded["id"])
+        RESPONSE_CACHE.invalidate(loaded["id"])
+        SEMANTIC_CACHE.invalidate(loaded["id"])
+        logging.info(f"Updated valves for module: {module_name}")
+    except Exception as e:
+        print(f"Error updating valves for module: {module_name}")
+        print(e)
+
+
+async def unload_pipeline(module_name):
+    pipeline_id = PIPELINE_FILES.pop(module_name)["id"]
+    pipeline = PIPELINE_MODULES.pop(pipeline_id, None)
+    PIPELINE_NAMES.pop(pipeline_id, None)
+    PIPELINE_STATES.pop(pipeline_id, None)
+    MODEL_LISTS.discard(pipeline_id)
+    ADMISSION.discard(pipeline_id)
+    EXECUTORS.discard(pipeline_id)
+    RESPONSE_CACHE.invalidate(pipeline_id)
+    SEMANTIC_CACHE.invalidate(pipeline_id)
+
+    if hasattr(pipeline, "on_shutdown"):
+        try:
+            await HOOK_LOOPS.run(pipeline_id, pipeline.on_shutdown)
+        except Exception as e:
+            print(f"Error shutting down module: {module_name}")
+            print(e)
+    HOOK_LOOPS.discard(pipeline_id)
+    logging.info(f"Unloaded module: {module_name}")
+
+
+def list_module_names(directory) -> List[str]:
+    return [
+        filename[:-3]  # Remove the .py extension
+        for filename in os.listdir(directory)
+        if filename.endswith(".py")
+    ]
+
+
+async def on_startup():
+    # Starting from an empty table, reload() loads and starts every pipeline
+    await reload()
+    STARTUP_COMPLETE.set()
 
 
 async def on_shutdown():
-    for module in PIPELINE_MODULES.values():
+    for pipeline_id, module in PIPELINE_MODULES.items():
         if hasattr(module, "on_shutdown"):
-            await module.on_shutdown()
+            await HOOK_LOOPS.run(pipeline_id, module.on_shutdown)
 
 
 async def reload():
-    await on_shutdown()
-    # Clear existing pipelines
-    PIPELINES.clear()
-    PIPELINE_MODULES.clear()
-    PIPELINE_NAMES.clear()
-    # Load pipelines afresh
-    await on_startup()
+    """
+    Reloads only the pipelines whose file was added, changed or removed since
+    they were loaded and applies changed valves.json files in place; untouched
+    pipelines keep running.
+    """
+    async with RELOAD_LOCK:
+        # Failed pipelines are retried below if their file is still there and
+        # no longer being imported
+        for key in [
+            key
+            for key, state in PIPELINE_STATES.items()
+            if state["status"] == "failed" and key not in IMPORTING
+        ]:
+            del PIPELINE_STATES[key]
+
+        fingerprints = {
+            module_name: get_fingerprint(PIPELINES_DIR, module_name)
+            for module_name in list_module_names(PIPELINES_DIR)
+        }
+
+        stale, updated = [], []
+        for module_name, loaded in PIPELINE_FILES.items():
+            fingerprint = fingerprints.get(module_name)
+            if (
+                fingerprint is None
+                or fingerprint["source"] != loaded["fingerprint"]["source"]
+            ):
+                stale.append(module_name)
+            elif fingerprint["valves"] != loaded["fingerprint"]["valves"]:
+                updated.append(module_name)
+
+        for module_name in stale:
+            await unload_pipeline(module_name)
+        for module_name in updated:
+            await reload_valves(module_name)
+
+        pipeline_ids = await load_pipelines(
+            PIPELINES_DIR,
+            [
+                module_name
+                for module_name in fingerprints
+                if module_name not in PIPELINE_FILES and module_name not in IMPORTING
+            ],
+        )
+        print_startup_report(pipeline_ids)
+
+        # Manifolds may only know their models once started
+        REGISTRY.rebuild()
+        refresh_model_lists()
+
+
+async def watch_pipelines_dir():
+    try:
+        from watchfiles import awatch
+    except ImportError:
+        logging.warning("watchfiles not installed, PIPELINES_WATCH ignored")
+        return
+
+    pipelines_dir = os.path.abspath(PIPELINES_DIR)
+
+    def is_pipeline_file(change, path):
+        return path.endswith(".py") and os.path.dirname(path) == pipelines_dir
+
+    async for changes in awatch(pipelines_dir, watch_filter=is_pipeline_file):
+        logging.info(f"Pipelines changed: {changes}")
+        try:
+            await reload()
+        except Exception as e:
+            print(f"Error reloading pipelines: {e}")
+
+
+async def sync_workers():
+    # Picks up changes made through the other worker processes
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        if GENERATION.changed():
+            logging.info("Pipelines changed by another worker")
+            try:
+                await reload()
+            except Exception as e:
+                print(f"Error reloading pipelines: {e}")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await on_startup()
+    # Serve right away: imports and on_startup hooks run off this loop, and each
+    # pipeline becomes available once it is ready (see /ready)
+    startup = asyncio.create_task(on_startup())
+    watcher = asyncio.create_task(watch_pipelines_dir()) if PIPELINES_WATCH else None
+    syncer = asyncio.create_task(sync_workers()) if SYNC_INTERVAL else None
+    exporter = asyncio.create_task(TRACER.run_exporter()) if TRACER.enabled else None
     yield
+    if watcher:
+        watcher.cancel()
+    if syncer:
+        syncer.cancel()
+    if exporter:
+        # Flushes the remaining spans on the way out
+        exporter.cancel()
+        await asyncio.gather(exporter, return_exceptions=True)
+    startup.cancel()
     await on_shutdown()
+    # Before the hook loops stop, so that sessions created by hooks are closed too
+    await HTTP_CLIENTS.close()
+    HOOK_LOOPS.close()
 
 
-app = FastAPI(docs_url="/docs", redoc_url=None, lifespan=lifespan)
+app = FastAPI(
+    docs_url="/docs",
+    redoc_url=None,
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
+)
 
-app.state.PIPELINES = PIPELINES
+# Parse request bodies with orjson when available; must be set before any route is declared
+app.router.route_class = FastJSONRoute
 
 
 origins = ["*"]
 
+# Added before CORS so that rejections still carry CORS headers
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=ADMISSION,
+    resolve=get_target_pipeline,
+    pipelines=PIPELINE_MODULES.values,
+)
+
+# Outside admission, so that time spent queued is part of the request's trace
+app.add_middleware(TracingMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -233,7 +784,6 @@ app.add_middleware(
 @app.middleware("http")
 async def check_url(request: Request, call_next):
     start_time = int(time.time())
-    app.state.PIPELINES = get_all_pipelines()
     response = await call_next(request)
     process_time = int(time.time()) - start_time
     response.headers["X-Process-Time"] = str(process_time)
@@ -247,37 +797,41 @@ async def get_models():
     """
     Returns the available pipelines
     """
-    app.state.PIPELINES = get_all_pipelines()
-    return {
-        "data": [
-            {
-                "id": pipeline["id"],
-                "name": pipeline["name"],
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "openai",
-                "pipeline": {
-                    "type": pipeline["type"],
-                    **(
-                        {
-                            "pipelines": (
-                                pipeline["valves"].pipelines
-                                if pipeline.get("valves", None)
-                                else []
-                            ),
-                            "priority": pipeline.get("priority", 0),
-                        }
-                        if pipeline.get("type", "pipe") == "filter"
-                        else {}
-                    ),
-                    "valves": pipeline["valves"] != None,
-                },
-            }
-            for pipeline in app.state.PIPELINES.values()
-        ],
-        "object": "list",
-        "pipelines": True,
-    }
+    # Serves the cached lists; expired ones are revalidated in the background
+    refresh_model_lists()
+    pipelines = REGISTRY.snapshot()
+    return FastJSONResponse(
+        {
+            "data": [
+                {
+                    "id": pipeline["id"],
+                    "name": pipeline["name"],
+                    "object": "model",
+                    "created": int(time.time()),
+                    "owned_by": "openai",
+                    "pipeline": {
+                        "type": pipeline["type"],
+                        **(
+                            {
+                                "pipelines": (
+                                    pipeline["valves"].pipelines
+                                    if pipeline.get("valves", None)
+                                    else []
+                                ),
+                                "priority": pipeline.get("priority", 0),
+                            }
+                            if pipeline.get("type", "pipe") == "filter"
+                            else {"filters": list(pipeline["filters"])}
+                        ),
+                        "valves": pipeline["valves"] != None,
+                    },
+                }
+                for pipeline in pipelines.values()
+            ],
+            "object": "list",
+            "pipelines": True,
+        }
+    )
 
 
 @app.get("/v1")
@@ -286,6 +840,50 @@ async def get_status():
     return {"status": True}
 
 
+@app.get("/v1/ready")
+@app.get("/ready")
+async def get_readiness():
+    """
+    Returns the load/startup state and timings of every pipeline.
+    Responds 503 until the first pipeline is ready or startup has finished.
+    """
+    pipelines = {
+        pipeline_id: {
+            "status": state["status"],
+            "module": state["module"],
+            "load": state["load"],
+            "startup": state["startup"],
+        }
+        for pipeline_id, state in list(PIPELINE_STATES.items())
+    }
+    ready = STARTUP_COMPLETE.is_set() or any(
+        state["status"] == "ready" for state in pipelines.values()
+    )
+
+    return FastJSONResponse(
+        {
+            "status": ready,
+            "startup_complete": STARTUP_COMPLETE.is_set(),
+            "pipelines": pipelines,
+        },
+        status_code=(
+            status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        ),
+    )
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/v1/admission")
+@app.get("/admission")
+async def get_admission():
+    # In-flight and queued completion requests, rejections and time spent queued
+    return FastJSONResponse(ADMISSION.stats())
+
+
 @app.get("/v1/pipelines")
 @app.get("/pipelines")
 async def list_pipelines(user: str = Depends(get_current_user)):
@@ -305,6 +903,7 @@ async def list_pipelines(user: str = Depends(get_current_user)):
                         if hasattr(PIPELINE_MODULES[pipeline_id], "valves")
                         else False
                     ),
+                    "status": PIPELINE_STATES.get(pipeline_id, {}).get("status"),
                 }
                 for pipeline_id in list(PIPELINE_MODULES.keys())
             ]
@@ -330,15 +929,14 @@ async def download_file(url: str, dest_folder: str):
 
     file_path = os.path.join(dest_folder, filename)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Failed to download file",
-                )
-            with open(file_path, "wb") as f:
-                f.write(await response.read())
+    async with HTTP_CLIENTS.async_session(url).get(url) as response:
+        if response.status != 200:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Failed to download file",
+            )
+        with open(file_path, "wb") as f:
+            f.write(await response.read())
 
     return file_path
 
@@ -359,6 +957,7 @@ async def add_pipeline(
 
         print(url)
         file_path = await download_file(url, dest_folder=PIPELINES_DIR)
+        GENERATION.bump()
         await reload()
         return {
             "status": True,
@@ -403,6 +1002,7 @@ async def upload_pipeline(
             shutil.copyfileobj(file.file, buffer)
 
         # Perform any necessary reload or processing
+        GENERATION.bump()
         await reload()
 
         return {
@@ -436,13 +1036,11 @@ async def delete_pipeline(
     pipeline_id = form_data.id
     pipeline_name = PIPELINE_NAMES.get(pipeline_id.split(".")[0], None)
 
-    if PIPELINE_MODULES[pipeline_id]:
-        if hasattr(PIPELINE_MODULES[pipeline_id], "on_shutdown"):
-            await PIPELINE_MODULES[pipeline_id].on_shutdown()
-
+    # reload() shuts the pipeline down once its file is gone
     pipeline_path = os.path.join(PIPELINES_DIR, f"{pipeline_name}.py")
     if os.path.exists(pipeline_path):
         os.remove(pipeline_path)
+        GENERATION.bump()
         await reload()
         return {
             "status": True,
@@ -459,6 +1057,7 @@ async def delete_pipeline(
 @app.post("/pipelines/reload")
 async def reload_pipelines(user: str = Depends(get_current_user)):
     if user == API_KEY:
+        GENERATION.bump()
         await reload()
         return {"message": "Pipelines reloaded successfully."}
     else:
@@ -468,6 +1067,58 @@ async def reload_pipelines(user: str = Depends(get_current_user)):
         )
 
 
+@app.post("/v1/profile")
+@app.post("/profile")
+async def profile_pipelines(
+    seconds: float = 10,
+    interval: float = 0.01,
+    pipeline_id: Optional[str] = None,
+    format: str = "collapsed",
+    user: str = Depends(get_current_user),
+):
+    if user != API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid API key",
+        )
+
+    if (
+        not 0 < seconds <= 300
+        or not 0.001 <= interval <= 1
+        or format not in ["collapsed", "speedscope"]
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected 0 < seconds <= 300, 0.001 <= interval <= 1 and format collapsed or speedscope",
+        )
+
+    filenames = None
+    if pipeline_id:
+        target = get_target_pipeline(pipeline_id)
+        if not target:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Pipeline {pipeline_id} not found",
+            )
+        # Keep only stacks that pass through the pipeline's own file
+        filenames = [os.path.join(PIPELINES_DIR, f"{PIPELINE_NAMES[target[0]]}.py")]
+
+    if PROFILE_LOCK.locked():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A profile is already running",
+        )
+
+    async with PROFILE_LOCK:
+        profiler = SamplingProfiler(interval=interval, filenames=filenames)
+        # Samples from its own thread, so the event loop keeps serving and is sampled too
+        await asyncio.get_running_loop().run_in_executor(None, profiler.run, seconds)
+
+    if format == "speedscope":
+        return FastJSONResponse(profiler.speedscope(name=pipeline_id or "pipelines"))
+    return Response(profiler.collapsed(), media_type="text/plain")
+
+
 @app.get("/v1/{pipeline_id}/valves")
 @app.get("/{pipeline_id}/valves")
 async def get_valves(pipeline_id: str):
@@ -485,7 +1136,7 @@ async def get_valves(pipeline_id: str):
             detail=f"Valves for {pipeline_id} not found",
         )
 
-    return pipeline.valves
+    return FastJSONResponse(pipeline.valves)
 
 
 @app.get("/v1/{pipeline_id}/valves/spec")
@@ -505,7 +1156,7 @@ async def get_valves_spec(pipeline_id: str):
             detail=f"Valves for {pipeline_id} not found",
         )
 
-    return pipeline.valves.schema()
+    return FastJSONResponse(pipeline.valves.schema())
 
 
 @app.post("/v1/{pipeline_id}/valves/update")
@@ -536,11 +1187,22 @@ async def update_valves(pipeline_id: str, form_data: dict):
         valves_json_path = os.path.join(subfolder_path, "valves.json")
 
         # Save the updated valves data back to the valves.json file
-        with open(valves_json_path, "w") as f:
-            json.dump(valves.model_dump(), f)
+        write_file_atomic(valves_json_path, json.dumps(valves.model_dump()))
+
+        # Valves are already applied here; the other workers apply them on their next reload()
+        PIPELINE_FILES[PIPELINE_NAMES[pipeline_id]]["fingerprint"] = get_fingerprint(
+            PIPELINES_DIR, PIPELINE_NAMES[pipeline_id]
+        )
+        GENERATION.bump()
 
         if hasattr(pipeline, "on_valves_updated"):
-            await pipeline.on_valves_updated()
+            await HOOK_LOOPS.run(pipeline_id, pipeline.on_valves_updated)
+
+        MODEL_LISTS.invalidate(pipeline_id)
+        RESPONSE_CACHE.invalidate(pipeline_id)
+        SEMANTIC_CACHE.invalidate(pipeline_id)
+        REGISTRY.rebuild()
+        refresh_model_lists()
     except Exception as e:
         print(e)
         raise HTTPException(
@@ -548,20 +1210,78 @@ async def update_valves(pipeline_id: str, form_data: dict):
             detail=f"{str(e)}",
         )
 
-    return pipeline.valves
+    return FastJSONResponse(pipeline.valves)
+
+
+async def call_filter(pipeline_id: str, pipeline, stage: str, body: dict, user):
+    start_time = time.perf_counter()
+    try:
+        with TRACER.start_span(f"filter.{stage}", filter=pipeline_id):
+            return await getattr(pipeline, stage)(body, user)
+    finally:
+        metrics.FILTER_DURATION.labels(pipeline_id, stage).observe(
+            time.perf_counter() - start_time
+        )
+
+
+async def run_filter_chain(stage: str, form_data: FilterChainForm):
+    model_id = form_data.model or form_data.body.get("model")
+    if not model_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No target model given",
+        )
+
+    pipelines = REGISTRY.snapshot()
+    body = form_data.body
+    for filter_id in REGISTRY.filters(model_id):
+        pipeline = pipelines[filter_id]
+        module = PIPELINE_MODULES.get(pipeline["module"])
+        if not hasattr(module, stage):
+            continue
+
+        try:
+            body = await call_filter(filter_id, module, stage, body, form_data.user)
+        except Exception as e:
+            print(e)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"{pipeline['id']}: {str(e)}",
+            )
+
+    return FastJSONResponse(body)
+
+
+@app.post("/v1/filters/inlet")
+@app.post("/filters/inlet")
+async def filter_chain_inlet(form_data: FilterChainForm):
+    """
+    Runs every filter attached to the target model, in priority order
+    """
+    return await run_filter_chain("inlet", form_data)
+
+
+@app.post("/v1/filters/outlet")
+@app.post("/filters/outlet")
+async def filter_chain_outlet(form_data: FilterChainForm):
+    """
+    Runs every filter attached to the target model, in priority order
+    """
+    return await run_filter_chain("outlet", form_data)
 
 
 @app.post("/v1/{pipeline_id}/filter/inlet")
 @app.post("/{pipeline_id}/filter/inlet")
 async def filter_inlet(pipeline_id: str, form_data: FilterForm):
-    if pipeline_id not in app.state.PIPELINES:
+    pipelines = REGISTRY.snapshot()
+    if pipeline_id not in pipelines:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Filter {pipeline_id} not found",
         )
 
     try:
-        pipeline = app.state.PIPELINES[form_data.body["model"]]
+        pipeline = pipelines[form_data.body["model"]]
         if pipeline["type"] == "manifold":
             pipeline_id = pipeline_id.split(".")[0]
     except:
@@ -571,10 +1291,12 @@ async def filter_inlet(pipeline_id: str, form_data: FilterForm):
 
     try:
         if hasattr(pipeline, "inlet"):
-            body = await pipeline.inlet(form_data.body, form_data.user)
-            return body
+            body = await call_filter(
+                pipeline_id, pipeline, "inlet", form_data.body, form_data.user
+            )
+            return FastJSONResponse(body)
         else:
-            return form_data.body
+            return FastJSONResponse(form_data.body)
     except Exception as e:
         print(e)
         raise HTTPException(
@@ -586,14 +1308,15 @@ async def filter_inlet(pipeline_id: str, form_data: FilterForm):
 @app.post("/v1/{pipeline_id}/filter/outlet")
 @app.post("/{pipeline_id}/filter/outlet")
 async def filter_outlet(pipeline_id: str, form_data: FilterForm):
-    if pipeline_id not in app.state.PIPELINES:
+    pipelines = REGISTRY.snapshot()
+    if pipeline_id not in pipelines:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Filter {pipeline_id} not found",
         )
 
     try:
-        pipeline = app.state.PIPELINES[form_data.body["model"]]
+        pipeline = pipelines[form_data.body["model"]]
         if pipeline["type"] == "manifold":
             pipeline_id = pipeline_id.split(".")[0]
     except:
@@ -603,10 +1326,12 @@ async def filter_outlet(pipeline_id: str, form_data: FilterForm):
 
     try:
         if hasattr(pipeline, "outlet"):
-            body = await pipeline.outlet(form_data.body, form_data.user)
-            return body
+            body = await call_filter(
+                pipeline_id, pipeline, "outlet", form_data.body, form_data.user
+            )
+            return FastJSONResponse(body)
         else:
-            return form_data.body
+            return FastJSONResponse(form_data.body)
     except Exception as e:
         print(e)
         raise HTTPException(
@@ -618,129 +1343,310 @@ async def filter_outlet(pipeline_id: str, form_data: FilterForm):
 @app.post("/v1/chat/completions")
 @app.post("/chat/completions")
 async def generate_openai_chat_completion(form_data: OpenAIChatCompletionForm):
+    start_time = time.perf_counter()
+    start_time_ns = time.time_ns()
     messages = [message.model_dump() for message in form_data.messages]
     user_message = get_last_user_message(messages)
+    pipelines = REGISTRY.snapshot()
+
+    if form_data.model not in pipelines and PIPELINE_STATES.get(
+        form_data.model.split(".", 1)[0], {}
+    ).get("status") in ["loading", "starting"]:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Pipeline {form_data.model} is starting",
+            headers={"Retry-After": "5"},
+        )
 
     if (
-        form_data.model not in app.state.PIPELINES
-        or app.state.PIPELINES[form_data.model]["type"] == "filter"
+        form_data.model not in pipelines
+        or pipelines[form_data.model]["type"] == "filter"
     ):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {form_data.model} not found",
         )
 
-    def job():
-        print(form_data.model)
+    pipeline = pipelines[form_data.model]
+    pipeline_id = form_data.model
 
-        pipeline = app.state.PIPELINES[form_data.model]
-        pipeline_id = form_data.model
+    if pipeline["type"] == "manifold":
+        module_id, pipeline_id = pipeline_id.split(".", 1)
+    else:
+        module_id = pipeline_id
+    pipe = PIPELINE_MODULES[module_id].pipe
 
-        print(pipeline_id)
+    span_attributes = {"pipeline": module_id, "model": form_data.model}
+    for key, value in span_attributes.items():
+        TRACER.current().set_attribute(key, value)
 
-        if pipeline["type"] == "manifold":
-            manifold_id, pipeline_id = pipeline_id.split(".", 1)
-            pipe = PIPELINE_MODULES[manifold_id].pipe
+    # Sync work of a pipeline with a concurrency limit runs on its own threads
+    executor = EXECUTORS.get(module_id, PIPELINE_MODULES[module_id])
+
+    # Set if a streaming client disconnects early; pipes opt in with a cancel_event parameter
+    cancel_event = CancellationEvent()
+    pipe_kwargs = (
+        {"cancel_event": cancel_event}
+        if "cancel_event" in inspect.signature(pipe).parameters
+        else {}
+    )
+
+    # Frames of one stream share an id and timestamp, rendered once up front
+    encoder = StreamMessageEncoder(form_data.model) if form_data.stream else None
+
+    def stream_line(line) -> str:
+        if isinstance(line, BaseModel):
+            line = line.model_dump_json()
+            line = f"data: {line}"
+
+        try:
+            line = line.decode("utf-8")
+        except:
+            pass
+
+        logging.info(f"stream_content:Generator:{line}")
+
+        if line.startswith("data:"):
+            return f"{line}\n\n"
         else:
-            pipe = PIPELINE_MODULES[pipeline_id].pipe
+            return encoder.encode(line)
+
+    def completion_message(aggregator: CompletionAggregator) -> dict:
+        logging.info(f"stream:false:{aggregator.content}")
+        return aggregator.result()
+
+    def job():
+        print(form_data.model)
+        print(pipeline_id)
+
+        with TRACER.start_span("pipe.call", **span_attributes):
+            res = pipe(
+                user_message=user_message,
+                model_id=pipeline_id,
+                messages=messages,
+                body=form_data.model_dump(),
+                **pipe_kwargs,
+            )
+
+        if inspect.isawaitable(res) or isinstance(res, AsyncIterator):
+            # A plain `def pipe` that returned a coroutine or async generator is
+            # finished on the loop by run_pipe
+            return res
 
         if form_data.stream:
 
             def stream_content():
-                res = pipe(
-                    user_message=user_message,
-                    model_id=pipeline_id,
-                    messages=messages,
-                    body=form_data.model_dump(),
-                )
-
                 logging.info(f"stream:true:{res}")
 
                 if isinstance(res, str):
-                    message = stream_message_template(form_data.model, res)
+                    message = encoder.encode(res)
                     logging.info(f"stream_content:str:{message}")
-                    yield f"data: {json.dumps(message)}\n\n"
+                    yield message
 
                 if isinstance(res, Iterator):
-                    for line in res:
-                        if isinstance(line, BaseModel):
-                            line = line.model_dump_json()
-                            line = f"data: {line}"
+                    try:
+                        for line in res:
+                            yield stream_line(line)
+                    finally:
+                        # On disconnect the producer closes us; stop the pipe's generator too
+                        if hasattr(res, "close"):
+                            res.close()
 
-                        try:
-                            line = line.decode("utf-8")
-                        except:
-                            pass
+                if isinstance(res, str) or isinstance(res, Generator):
+                    yield encoder.finish
+                    yield encoder.done
+
+            # One producer thread per stream instead of a thread pool hop per chunk
+            return StreamingResponse(
+                iterate_in_thread(
+                    stream_content(),
+                    maxsize=STREAM_QUEUE_SIZE,
+                    name=f"stream-{form_data.model}",
+                    cancel=cancel_event,
+                    executor=executor,
+                ),
+                media_type="text/event-stream",
+            )
+        else:
+            logging.info(f"stream:false:{res}")
 
-                        logging.info(f"stream_content:Generator:{line}")
+            if isinstance(res, dict) or isinstance(res, BaseModel):
+                return FastJSONResponse(res)
+            else:
 
-                        if line.startswith("data:"):
-                            yield f"{line}\n\n"
-                        else:
-                            line = stream_message_template(form_data.model, line)
-                            yield f"data: {json.dumps(line)}\n\n"
+                aggregator = CompletionAggregator(form_data.model)
 
-                if isinstance(res, str) or isinstance(res, Generator):
-                    finish_message = {
-                        "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": form_data.model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {},
-                                "logprobs": None,
-                                "finish_reason": "stop",
-                            }
-                        ],
-                    }
+                if isinstance(res, str):
+                    aggregator.add(res)
 
-                    yield f"data: {json.dumps(finish_message)}\n\n"
-                    yield f"data: [DONE]"
+                if isinstance(res, Iterator):
+                    with TRACER.start_span("pipe.collect", **span_attributes):
+                        aggregator.extend(res)
+
+                return FastJSONResponse(completion_message(aggregator))
+
+    async def async_job(result=None):
+        # Async pipes run on the event loop: no worker thread is held while they await upstream
+        async def call_pipe():
+            if result is not None:
+                # Returned by a sync pipe (see job()), which has already been called
+                return await result if inspect.isawaitable(result) else result
+            with TRACER.start_span("pipe.call", **span_attributes):
+                res = pipe(
+                    user_message=user_message,
+                    model_id=pipeline_id,
+                    messages=messages,
+                    body=form_data.model_dump(),
+                    **pipe_kwargs,
+                )
+                if inspect.isawaitable(res):
+                    res = await res
+            return res
+
+        if form_data.stream:
+
+            async def stream_content():
+                res = await call_pipe()
+
+                logging.info(f"stream:true:{res}")
+
+                if isinstance(res, str):
+                    message = encoder.encode(res)
+                    logging.info(f"stream_content:str:{message}")
+                    yield message
+
+                if isinstance(res, AsyncIterator):
+                    async for line in iterate_with_cancel(res, cancel_event):
+                        yield stream_line(line)
+                elif isinstance(res, Iterator):
+                    # A sync iterator (e.g. r.iter_lines()) would block the loop
+                    async for line in iterate_in_thread(
+                        res,
+                        maxsize=STREAM_QUEUE_SIZE,
+                        name=f"stream-{form_data.model}",
+                        cancel=cancel_event,
+                        executor=executor,
+                    ):
+                        yield stream_line(line)
+
+                if (
+                    isinstance(res, str)
+                    or isinstance(res, Generator)
+                    or isinstance(res, AsyncGenerator)
+                ):
+                    yield encoder.finish
+                    yield encoder.done
 
             return StreamingResponse(stream_content(), media_type="text/event-stream")
         else:
-            res = pipe(
-                user_message=user_message,
-                model_id=pipeline_id,
-                messages=messages,
-                body=form_data.model_dump(),
-            )
+            res = await call_pipe()
             logging.info(f"stream:false:{res}")
 
-            if isinstance(res, dict):
-                return res
-            elif isinstance(res, BaseModel):
-                return res.model_dump()
+            if isinstance(res, dict) or isinstance(res, BaseModel):
+                return FastJSONResponse(res)
             else:
 
-                message = ""
+                aggregator = CompletionAggregator(form_data.model)
 
                 if isinstance(res, str):
-                    message = res
-
-                if isinstance(res, Generator):
-                    for stream in res:
-                        message = f"{message}{stream}"
-
-                logging.info(f"stream:false:{message}")
-                return {
-                    "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": form_data.model,
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": message,
-                            },
-                            "logprobs": None,
-                            "finish_reason": "stop",
-                        }
-                    ],
-                }
+                    aggregator.add(res)
+
+                with TRACER.start_span("pipe.collect", **span_attributes):
+                    if isinstance(res, AsyncIterator):
+                        async for chunk in res:
+                            aggregator.add(chunk)
+                    elif isinstance(res, Iterator):
+                        await run_in_executor(executor, aggregator.extend, res)
+
+                return FastJSONResponse(completion_message(aggregator))
+
+    stream = "true" if form_data.stream else "false"
+    metrics.REQUESTS.labels(module_id, form_data.model, stream).inc()
+
+    # Identical requests to a pipeline with cache_ttl are answered without calling pipe
+    cache_key = RESPONSE_CACHE.key(
+        module_id, PIPELINE_MODULES[module_id], form_data.model_dump()
+    )
+    cached = None
+    if cache_key is not None:
+        cached = await RESPONSE_CACHE.get(cache_key)
+        metrics.CACHE_REQUESTS.labels(
+            module_id, "exact", "hit" if cached is not None else "miss"
+        ).inc()
+
+    # Then near-duplicates of single-turn questions, for pipelines that also set semantic_cache
+    semantic_scope = embedding = None
+    if (
+        cache_key is not None
+        and cached is None
+        and SEMANTIC_CACHE.enabled(PIPELINE_MODULES[module_id])
+        and user_message
+    ):
+        semantic_scope = get_scope(module_id, form_data.model, messages)
+        if semantic_scope is not None:
+            embedding = await SEMANTIC_CACHE.embed(user_message)
+        if embedding is not None:
+            cached = SEMANTIC_CACHE.get(
+                semantic_scope, embedding, PIPELINE_MODULES[module_id]
+            )
+            metrics.CACHE_REQUESTS.labels(
+                module_id, "semantic", "hit" if cached is not None else "miss"
+            ).inc()
+
+    async def run_pipe():
+        if inspect.iscoroutinefunction(pipe) or inspect.isasyncgenfunction(pipe):
+            return await async_job()
+        response = await run_in_executor(executor, job)
+        if not isinstance(response, Response):
+            return await async_job(response)
+        return response
+
+    # Identical requests in flight at the same time share one run of the pipe
+    coalesce_key = get_coalesce_key(
+        module_id, PIPELINE_MODULES[module_id], form_data.model_dump(), COALESCE
+    )
 
-    return await run_in_threadpool(job)
+    try:
+        if cached is not None:
+            response = cached.response(form_data.model, form_data.stream)
+        elif coalesce_key is not None:
+            if coalesce_key in COALESCER:
+                metrics.COALESCED_REQUESTS.labels(module_id).inc()
+            response = await COALESCER.run(coalesce_key, run_pipe)
+        else:
+            response = await run_pipe()
+    except Exception:
+        metrics.REQUEST_ERRORS.labels(module_id, form_data.model, stream).inc()
+        raise
+
+    if cache_key is not None and cached is None:
+        cache_ttl = PIPELINE_MODULES[module_id].cache_ttl
+
+        def store(aggregator: CompletionAggregator):
+            entry = CachedCompletion.from_aggregator(aggregator, cache_ttl)
+            if entry is not None:
+                RESPONSE_CACHE.put(cache_key, entry)
+                if embedding is not None:
+                    SEMANTIC_CACHE.put(semantic_scope, embedding, entry)
+
+        if isinstance(response, StreamingResponse):
+            response.body_iterator = collect_stream(
+                response.body_iterator, form_data.model, store
+            )
+        elif response.status_code == 200:
+            store(collect_response(response.body, form_data.model))
+
+    if isinstance(response, StreamingResponse):
+        # Chunk timings are recorded as the stream is sent
+        response.body_iterator = trace_stream(
+            metrics.observe_stream(
+                response.body_iterator, module_id, form_data.model, start_time
+            ),
+            start_time_ns,
+            **span_attributes,
+        )
+    else:
+        metrics.REQUEST_DURATION.labels(module_id, form_data.model, stream).observe(
+            time.perf_counter() - start_time
+        )
+    return response
@@ -28,4 +28,8 @@ class OpenAIChatCompletionForm(BaseModel):
 class FilterForm(BaseModel):
     body: dict
     user: Optional[dict] = None
-    model_config = ConfigDict(extra="allow")
\ No newline at end of file
+    model_config = ConfigDict(extra="allow")
+
+class FilterChainForm(FilterForm):
+    # Target model; defaults to body["model"]
+    model: Optional[str] = None
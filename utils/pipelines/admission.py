@@ -0,0 +1,296 @@
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.pipelines.serialization import PARSED_BODY, FastJSONResponse, loads
+from utils.pipelines.tracing import TRACER
+
+import asyncio
+import time
+
+
+class Rejected(Exception):
+    pass
+
+
+class AdmissionGate:
+    """
+    Bounds the completion requests in flight for one scope: the whole server,
+    a single pipeline or a single manifold model.
+
+    Up to `limit` requests run at once (None means unlimited). Up to
+    `max_queue` more wait for a slot in arrival order, each for at most
+    `timeout` seconds. Anything beyond that is rejected right away. While the
+    gate is not saturated, admission is a couple of counter updates.
+    """
+
+    def __init__(
+        self, limit: Optional[int], max_queue: int, timeout: Optional[float] = None
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def acquire(self) -> float:
+        """
+        Takes a slot, queueing if needed. Returns the seconds spent waiting and
+        raises `Rejected` if the queue is full or the wait timed out.
+        """
+        waited = 0.0
+        if self._semaphore is not None:
+            if not self._semaphore.locked():
+                await self._semaphore.acquire()
+            elif self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise Rejected(f"{self.active} requests running, {self.waiting} queued")
+            else:
+                self.waiting += 1
+                start_time = time.perf_counter()
+                try:
+                    await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise Rejected(f"No slot freed up within {self.timeout}s")
+                finally:
+                    self.waiting -= 1
+
+                waited = time.perf_counter() - start_time
+                self.wait_time += waited
+                self.max_wait_time = max(self.max_wait_time, waited)
+
+        self.active += 1
+        self.admitted += 1
+        return waited
+
+    def release(self):
+        self.active -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_time": self.wait_time,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+class AdmissionController:
+    """
+    Holds the global gate, one gate per pipeline and one per limited manifold
+    model.
+
+    A pipeline's limits come from its `max_concurrency` and `max_queue`
+    attributes, defaulting to `pipeline_limit` and `pipeline_max_queue`. A
+    manifold can also limit single models with a `model_concurrency` dict,
+    e.g. `{"llama3": 2}` to match the backend's parallelism. Gates are rebuilt
+    when a reloaded pipeline declares different limits.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int],
+        max_queue: int,
+        pipeline_limit: Optional[int],
+        pipeline_max_queue: int,
+        timeout: Optional[float] = None,
+    ):
+        self.gate = AdmissionGate(limit, max_queue, timeout)
+        self.pipeline_limit = pipeline_limit
+        self.pipeline_max_queue = pipeline_max_queue
+        self.timeout = timeout
+        self.pipeline_gates: Dict[str, AdmissionGate] = {}
+        self.model_gates: Dict[str, AdmissionGate] = {}
+
+    def pipeline_gate(self, pipeline_id: str, pipeline) -> AdmissionGate:
+        limit = getattr(pipeline, "max_concurrency", self.pipeline_limit) or None
+        max_queue = getattr(pipeline, "max_queue", self.pipeline_max_queue)
+        return self._get_gate(self.pipeline_gates, pipeline_id, limit, max_queue)
+
+    def model_gate(
+        self, model_id: str, pipeline_id: str, pipeline
+    ) -> Optional[AdmissionGate]:
+        model_concurrency = getattr(pipeline, "model_concurrency", None) or {}
+        limit = model_concurrency.get(model_id[len(pipeline_id) + 1 :])
+        if not limit:
+            return None
+        max_queue = getattr(pipeline, "max_queue", self.pipeline_max_queue)
+        return self._get_gate(self.model_gates, model_id, limit, max_queue)
+
+    def _get_gate(
+        self,
+        gates: Dict[str, AdmissionGate],
+        key: str,
+        limit: Optional[int],
+        max_queue: int,
+    ) -> AdmissionGate:
+        gate = gates.get(key)
+        if gate is None or (gate.limit, gate.max_queue) != (limit, max_queue):
+            # Requests admitted by a replaced gate release it, not the new one
+            gate = AdmissionGate(limit, max_queue, self.timeout)
+            gates[key] = gate
+        return gate
+
+    def can_block(self, pipelines: Iterable) -> bool:
+        """
+        Whether any gate could hold back a request, given the loaded
+        `pipelines`; if not, admission can be skipped altogether.
+        """
+        if self.gate.limit:
+            return True
+        return any(
+            getattr(pipeline, "max_concurrency", self.pipeline_limit)
+            or any((getattr(pipeline, "model_concurrency", None) or {}).values())
+            for pipeline in pipelines
+        )
+
+    def discard(self, pipeline_id: str):
+        self.pipeline_gates.pop(pipeline_id, None)
+        for model_id in [
+            model_id
+            for model_id in self.model_gates
+            if model_id.startswith(f"{pipeline_id}.")
+        ]:
+            del self.model_gates[model_id]
+
+    def stats(self) -> dict:
+        return {
+            "global": self.gate.stats(),
+            "pipelines": {
+                pipeline_id: gate.stats()
+                for pipeline_id, gate in self.pipeline_gates.items()
+            },
+            "models": {
+                model_id: gate.stats() for model_id, gate in self.model_gates.items()
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits completion requests before FastAPI parses and
+    validates them.
+
+    Without any limit configured, requests pass straight through. Otherwise
+    the body is read and parsed once to find the target model, and the route
+    reuses the parsed body (see `PARSED_BODY`). The request then passes
+    the model's gate if it has one and the pipeline's gate (429 when full),
+    then the global gate (503 when full). It keeps its slots until the
+    response, including a stream, is finished.
+    Rejections carry `Retry-After`. Admitted responses carry `X-Queue-Time`.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController,
+        resolve: Callable[[str], Optional[Tuple[str, object]]],
+        pipelines: Callable[[], Iterable],
+        paths: Tuple[str, ...] = ("/chat/completions", "/v1/chat/completions"),
+        retry_after: int = 1,
+    ):
+        self.app = app
+        self.controller = controller
+        self.resolve = resolve
+        self.pipelines = pipelines
+        self.paths = paths
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+            or not self.controller.can_block(self.pipelines())
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away before sending the whole body
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # Later calls are the disconnect listener of streaming responses
+            return await receive()
+
+        parsed = parse_body(body)
+        if parsed is not None:
+            scope[PARSED_BODY] = parsed
+
+        gates = []
+        model_id = get_model(parsed)
+        target = self.resolve(model_id)
+        if target:
+            model_gate = self.controller.model_gate(model_id, *target)
+            if model_gate:
+                gates.append((model_gate, 429))
+            gates.append((self.controller.pipeline_gate(*target), 429))
+        gates.append((self.controller.gate, 503))
+
+        acquired = []
+        waited = 0.0
+        try:
+            for gate, status_code in gates:
+                try:
+                    waited += await gate.acquire()
+                except Rejected as e:
+                    response = FastJSONResponse(
+                        {"detail": f"Server busy: {e}"},
+                        status_code=status_code,
+                        headers={"Retry-After": str(self.retry_after)},
+                    )
+                    await response(scope, replay, send)
+                    return
+                acquired.append(gate)
+
+            async def send_with_queue_time(message: Message):
+                if message["type"] == "http.response.start":
+                    message["headers"] = [
+                        *message.get("headers", []),
+                        (b"x-queue-time", f"{waited:.3f}".encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, replay, send_with_queue_time)
+        finally:
+            for gate in reversed(acquired):
+                gate.release()
+
+
+def parse_body(body: bytes) -> Optional[Any]:
+    # Invalid bodies are left for FastAPI to reject
+    with TRACER.start_span("body.parse"):
+        try:
+            return loads(body)
+        except Exception:
+            return None
+
+
+def get_model(parsed: Any) -> Optional[str]:
+    model = parsed.get("model") if isinstance(parsed, dict) else None
+    return model if isinstance(model, str) else None
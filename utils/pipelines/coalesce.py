@@ -0,0 +1,251 @@
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+import asyncio
+import hashlib
+import json
+
+
+def get_coalesce_key(
+    pipeline_id: str, pipeline, body: dict, default: bool
+) -> Optional[str]:
+    """
+    Returns the key that identical requests in flight share, or None if the
+    request must run on its own. A pipeline's `coalesce` attribute decides
+    for all its requests. Without it, `default` applies, and only to requests
+    with `temperature` explicitly 0: sampled completions are never shared.
+    """
+    coalesce = getattr(pipeline, "coalesce", None)
+    if coalesce is None:
+        if not default or body.get("temperature") != 0:
+            return None
+    elif not coalesce:
+        return None
+
+    # Byte-identical requests only: same pipeline, messages, parameters, user and chat
+    return (
+        f"{pipeline_id}/"
+        + hashlib.sha256(
+            json.dumps(body, sort_keys=True, default=str).encode()
+        ).hexdigest()
+    )
+
+
+class _Subscriber:
+    # One reader of a SharedStream, from the moment it is handed a response
+
+    def __init__(self, stream: "SharedStream"):
+        self.stream = stream
+        self.position = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        try:
+            chunk = await self.stream._next(self)
+        except BaseException:
+            self.close()
+            raise
+        if chunk is _END:
+            self.close()
+            raise StopAsyncIteration
+        return chunk
+
+    async def aclose(self):
+        self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.stream._leave(self)
+
+
+class _SubscriberResponse(StreamingResponse):
+    # Leaves the stream once sent, whether it was read to the end, the client
+    # went away or sending failed, even if the body iterator has been wrapped
+
+    def __init__(self, subscriber: _Subscriber, **kwargs):
+        super().__init__(subscriber, **kwargs)
+        self.subscriber = subscriber
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.subscriber.close()
+
+
+_END = object()
+
+
+class SharedStream:
+    """
+    The chunks of one upstream stream, buffered so that every subscriber
+    gets all of them, including subscribers that join midway.
+
+    A pump task reads the upstream at the pace of the slowest subscriber: it
+    stays at most `maxsize` chunks ahead of it, so the backpressure of a
+    single stream is kept. The buffer holds the chunks read so far, at most
+    one answer. A subscriber leaves once its response has been sent, or
+    failed to send. When the last subscriber leaves before the end, the pump
+    is cancelled, which closes the upstream as if its only client had
+    disconnected, and the stream can no longer be joined.
+    """
+
+    def __init__(
+        self, iterator: AsyncIterator, on_done: Callable[[], None], maxsize: int = 64
+    ):
+        self.chunks: List = []
+        self.done = False
+        self.abandoned = False
+        self.error: Optional[BaseException] = None
+        self.maxsize = maxsize
+        self._subscribers: Set[_Subscriber] = set()
+        self._on_done = on_done
+        self._changed = asyncio.Event()
+        self._pump = asyncio.create_task(self._run(iterator))
+
+    async def _run(self, iterator: AsyncIterator):
+        try:
+            async for chunk in iterator:
+                self.chunks.append(chunk)
+                self._notify()
+                while len(self.chunks) - self._slowest() >= self.maxsize:
+                    await self._changed.wait()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+            self._on_done()
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    def _slowest(self) -> int:
+        return min((subscriber.position for subscriber in self._subscribers), default=0)
+
+    def _notify(self):
+        # Wakes the subscribers waiting for the next chunk and the pump waiting for them
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def response(self, status_code: int, media_type: Optional[str]):
+        subscriber = _Subscriber(self)
+        self._subscribers.add(subscriber)
+        return _SubscriberResponse(
+            subscriber, status_code=status_code, media_type=media_type
+        )
+
+    async def _next(self, subscriber: _Subscriber):
+        while True:
+            if subscriber.position < len(self.chunks):
+                chunk = self.chunks[subscriber.position]
+                subscriber.position += 1
+                self._notify()
+                return chunk
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return _END
+            await self._changed.wait()
+
+    def _leave(self, subscriber: _Subscriber):
+        self._subscribers.discard(subscriber)
+        self._notify()
+        self.release()
+
+    def release(self):
+        # Stops the upstream if nobody reads the stream anymore
+        if not self._subscribers and not self.done and not self.abandoned:
+            # Unjoinable from now on, so a late request runs afresh instead of
+            # getting the cut-off stream
+            self.abandoned = True
+            self._on_done()
+            self._pump.cancel()
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        # Requests waiting for the task to return their response
+        self.waiters = 0
+
+
+class Coalescer:
+    """
+    Single-flight execution of identical concurrent completion requests.
+
+    The first request for a key runs; the requests with the same key that
+    arrive while it is in flight attach to it instead of calling the pipe
+    again. They share its final response, or subscribe to its stream from a
+    shared chunk buffer. The execution runs in its own task, so it is not
+    cut short when the request that started it goes away while others still
+    wait for it. Once it has finished, the next request runs again.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._flights: Dict[str, _Flight] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: str, produce: Callable[[], Awaitable[Response]]):
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(asyncio.create_task(self._produce(key, produce)))
+                self._flights[key] = flight
+
+            flight.waiters += 1
+            try:
+                response, stream = await asyncio.shield(flight.task)
+            except BaseException as e:
+                flight.waiters -= 1
+                if isinstance(e, asyncio.CancelledError) and flight.waiters == 0:
+                    # Every request left before the response; nobody will read its stream
+                    flight.task.add_done_callback(lambda task: self._release(flight))
+                raise
+            flight.waiters -= 1
+
+            if stream is None:
+                return response
+            # An abandoned stream has already left the flights; start another
+            if not stream.abandoned:
+                return stream.response(response.status_code, response.media_type)
+
+    def _release(self, flight: _Flight):
+        if flight.waiters or flight.task.cancelled() or flight.task.exception():
+            return
+        _, stream = flight.task.result()
+        if stream is not None:
+            stream.release()
+
+    async def _produce(self, key: str, produce: Callable[[], Awaitable[Response]]):
+        try:
+            response = await produce()
+        except BaseException:
+            self._flights.pop(key, None)
+            raise
+
+        if not isinstance(response, StreamingResponse):
+            self._flights.pop(key, None)
+            return response, None
+
+        # Stays joinable until the stream has been read to the end
+        flight = self._flights.get(key)
+
+        def on_done():
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        return response, SharedStream(response.body_iterator, on_done, self.maxsize)
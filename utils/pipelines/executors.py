@@ -0,0 +1,149 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from fastapi.concurrency import run_in_threadpool
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import threading
+
+
+def get_max_workers(pipeline) -> Optional[int]:
+    # Per-model limits are enforced by the admission gates, not by the pool size
+    return getattr(pipeline, "max_concurrency", None) or None
+
+
+class PipelineExecutors:
+    """
+    One bounded thread pool per pipeline that declares a concurrency limit.
+
+    The sync pipes of such a pipeline run and stream on its own threads rather
+    than on the shared default pool, so a slow local model cannot starve other
+    pipelines of worker threads. Work beyond the pool size waits in the pool's
+    FIFO queue. Pipelines without a limit keep using the default pool.
+
+    A pool is sized from the pipeline's `max_concurrency`, else
+    `default_limit`. A manifold's `model_concurrency` does not size it, so
+    that limiting one model leaves its other models unlimited.
+    """
+
+    def __init__(self, default_limit: Optional[int] = None):
+        self.default_limit = default_limit
+        self._executors: Dict[str, Tuple[int, ThreadPoolExecutor]] = {}
+
+    def get(self, pipeline_id: str, pipeline) -> Optional[ThreadPoolExecutor]:
+        workers = get_max_workers(pipeline) or self.default_limit
+        if not workers:
+            return None
+
+        entry = self._executors.get(pipeline_id)
+        if entry is None or entry[0] != workers:
+            # A replaced pool is not shut down: requests holding it finish on it,
+            # and its idle threads exit once it is garbage collected
+            entry = (
+                workers,
+                ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=f"pipeline-{pipeline_id}"
+                ),
+            )
+            self._executors[pipeline_id] = entry
+        return entry[1]
+
+    def discard(self, pipeline_id: str):
+        self._executors.pop(pipeline_id, None)
+
+
+async def run_in_executor(executor: Optional[Executor], func: Callable, *args):
+    """Like `run_in_threadpool`, on `executor` when one is given."""
+    if executor is None:
+        return await run_in_threadpool(func, *args)
+
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(context.run, func, *args)
+    )
+
+
+class HookLoop:
+    """
+    An event loop on its own thread that runs one pipeline's lifecycle hooks
+    (`on_startup`, `on_valves_updated`, `on_shutdown`).
+
+    Hooks are often `async def` but block, e.g. while loading a model or
+    building an index. On the server's loop they would stall every request
+    and could not be timed out. Here the caller awaits the hook without
+    blocking, and `run()` enforces its timeout. The loop keeps running
+    between hooks, so tasks a hook starts in the background keep running,
+    and later hooks see the objects of the earlier ones on their own loop.
+    `close()` cancels what is left and stops the thread.
+    """
+
+    def __init__(self, name: str):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    async def run(self, hook: Callable[[], Awaitable], timeout: Optional[float] = None):
+        """
+        Runs `hook` on this loop; on timeout the hook is cancelled at its next
+        await and `asyncio.TimeoutError` is raised right away.
+        """
+
+        async def call():
+            result = hook()
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+        future = asyncio.run_coroutine_threadsafe(call(), self.loop)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+
+    def close(self):
+        try:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        except RuntimeError:
+            # Already closed
+            pass
+
+
+class HookLoops:
+    """The `HookLoop` of each pipeline, started when it first runs a hook."""
+
+    def __init__(self):
+        self._loops: Dict[str, HookLoop] = {}
+
+    def get(self, pipeline_id: str) -> HookLoop:
+        hook_loop = self._loops.get(pipeline_id)
+        if hook_loop is None:
+            hook_loop = self._loops[pipeline_id] = HookLoop(f"hooks-{pipeline_id}")
+        return hook_loop
+
+    async def run(
+        self,
+        pipeline_id: str,
+        hook: Callable[[], Awaitable],
+        timeout: Optional[float] = None,
+    ):
+        return await self.get(pipeline_id).run(hook, timeout)
+
+    def discard(self, pipeline_id: str):
+        hook_loop = self._loops.pop(pipeline_id, None)
+        if hook_loop:
+            hook_loop.close()
+
+    def close(self):
+        for pipeline_id in list(self._loops):
+            self.discard(pipeline_id)
@@ -0,0 +1,169 @@
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+
+import aiohttp
+import asyncio
+import requests
+import threading
+
+
+def get_origin(url: str) -> str:
+    # Connections are pooled per scheme, host and port; paths share a pool
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+class _Session(requests.Session):
+    # A requests session with default timeouts and without a cookie jar shared across users
+
+    def __init__(self, timeout: Tuple[float, float], pool_size: int):
+        super().__init__()
+        self.timeout = timeout
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(*args, **kwargs)
+
+    def stats(self) -> dict:
+        requests_sent = connections = 0
+        for adapter in self.adapters.values():
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is not None:
+                    requests_sent += pool.num_requests
+                    connections += pool.num_connections
+        return {"requests": requests_sent, "connections": connections}
+
+
+class _AsyncStats:
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.connections += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+
+class HTTPClients:
+    """
+    Keep-alive HTTP clients shared by all pipelines, one connection pool per
+    upstream origin, so that consecutive messages to the same provider reuse
+    a connection instead of opening a new TCP and TLS connection each time.
+
+    `session(url)` returns a `requests.Session` for sync pipes, usable from
+    any thread. `async_session(url)` returns an `aiohttp.ClientSession` for
+    async pipes and filters, one per origin and event loop, since a session
+    only works on the loop it was created on (lifecycle hooks run on their
+    own loop, see `HookLoop`). Both apply the
+    connect and read timeouts unless a call passes its own, keep at most
+    `pool_size` connections per origin and never store cookies. The async
+    sessions cache DNS lookups for `dns_ttl` seconds; sync sessions resolve
+    only when they open a new connection.
+
+    The server injects its instance as the `http` attribute of every
+    pipeline that does not set one, and closes all sessions on shutdown.
+    `stats()` reports requests sent and connections opened per origin;
+    the difference is the number of requests that reused a connection.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 100,
+        connect_timeout: float = 10,
+        read_timeout: float = 300,
+        dns_ttl: int = 300,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.dns_ttl = dns_ttl
+        self._sessions: Dict[str, _Session] = {}
+        self._async_sessions: Dict[
+            Tuple[str, asyncio.AbstractEventLoop], aiohttp.ClientSession
+        ] = {}
+        self._async_stats: Dict[str, _AsyncStats] = {}
+        self._lock = threading.Lock()
+
+    def session(self, url: str) -> requests.Session:
+        origin = get_origin(url)
+        session = self._sessions.get(origin)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(origin)
+                if session is None:
+                    session = _Session(
+                        (self.connect_timeout, self.read_timeout), self.pool_size
+                    )
+                    self._sessions[origin] = session
+        return session
+
+    def async_session(self, url: str) -> aiohttp.ClientSession:
+        origin = get_origin(url)
+        loop = asyncio.get_running_loop()
+        session = self._async_sessions.get((origin, loop))
+        if session is None or session.closed:
+            # Forget the sessions of loops that have been closed since
+            for key in [key for key in self._async_sessions if key[1].is_closed()]:
+                del self._async_sessions[key]
+
+            stats = self._async_stats.get(origin)
+            if stats is None:
+                stats = self._async_stats[origin] = _AsyncStats()
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size, ttl_dns_cache=self.dns_ttl
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=self.connect_timeout,
+                    sock_read=self.read_timeout,
+                ),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                trace_configs=[stats.trace_config()],
+            )
+            self._async_sessions[(origin, loop)] = session
+        return session
+
+    def stats(self) -> Dict[str, dict]:
+        stats = {}
+        for origin, session in list(self._sessions.items()):
+            stats.setdefault(origin, {})["sync"] = session.stats()
+        for origin, async_stats in list(self._async_stats.items()):
+            stats.setdefault(origin, {})["async"] = {
+                "requests": async_stats.requests,
+                "connections": async_stats.connections,
+            }
+        return stats
+
+    async def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            session.close()
+
+        loop = asyncio.get_running_loop()
+        async_sessions, self._async_sessions = self._async_sessions, {}
+        for (_, session_loop), session in async_sessions.items():
+            if session_loop is loop:
+                await session.close()
+            elif session_loop.is_running():
+                await asyncio.wrap_future(
+                    asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+                )
@@ -0,0 +1,260 @@
+from bisect import bisect_left
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers both proxied first tokens and slow local generations
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+CHUNK_GAP_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """
+    A labelled metric rendered in the Prometheus text format.
+
+    Updates take no lock: they are plain attribute increments made from the
+    event loop thread, which makes them cheap enough for the per-chunk path.
+    Look children up once with `labels()` and keep them for hot loops.
+    Metrics created with `collect` are computed at scrape time instead.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        collect: Optional[Callable[[], Iterable[Tuple[tuple, float]]]] = None,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.collect = collect
+        self._children: Dict[tuple, object] = {}
+        REGISTRY.append(self)
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            child = self._children[labelvalues] = self._new_child()
+        return child
+
+    def _new_child(self):
+        return _Value()
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        if self.collect is not None:
+            for labelvalues, value in self.collect():
+                yield self.name, self._format_labels(labelvalues), value
+            return
+
+        for labelvalues, child in list(self._children.items()):
+            yield self.name, self._format_labels(labelvalues), child.value
+
+    def _format_labels(self, labelvalues: tuple, extra: str = "") -> str:
+        labels = [
+            f'{name}="{escape(str(value))}"'
+            for name, value in zip(self.labelnames, labelvalues)
+        ]
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(
+            f"{name}{labels} {value}" for name, labels, value in self.samples()
+        )
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for labelvalues, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (
+                    f"{self.name}_bucket",
+                    self._format_labels(labelvalues, f'le="{le}"'),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", self._format_labels(labelvalues), child.sum
+            yield f"{self.name}_count", self._format_labels(labelvalues), child.count
+
+
+REGISTRY: List[Metric] = []
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter(
+    "pipelines_requests_total",
+    "Chat completion requests.",
+    ("pipeline", "model", "stream"),
+)
+REQUEST_ERRORS = Counter(
+    "pipelines_request_errors_total",
+    "Chat completion requests that failed, including streams that failed midway.",
+    ("pipeline", "model", "stream"),
+)
+REQUEST_DURATION = Histogram(
+    "pipelines_request_duration_seconds",
+    "Time from receiving a chat completion request to its last byte.",
+    ("pipeline", "model", "stream"),
+)
+TIME_TO_FIRST_CHUNK = Histogram(
+    "pipelines_time_to_first_chunk_seconds",
+    "Time from receiving a streaming request to its first chunk.",
+    ("pipeline", "model"),
+)
+INTER_CHUNK_GAP = Histogram(
+    "pipelines_inter_chunk_seconds",
+    "Time between consecutive chunks of a stream.",
+    ("pipeline", "model"),
+    buckets=CHUNK_GAP_BUCKETS,
+)
+CHUNKS = Counter(
+    "pipelines_stream_chunks_total",
+    "SSE chunks streamed to clients.",
+    ("pipeline", "model"),
+)
+STREAMS_IN_FLIGHT = Gauge(
+    "pipelines_streams_in_flight",
+    "Streams currently being sent.",
+    ("pipeline",),
+)
+CACHE_REQUESTS = Counter(
+    "pipelines_cache_requests_total",
+    "Cacheable chat completion requests by cache and result (hit or miss).",
+    ("pipeline", "cache", "result"),
+)
+COALESCED_REQUESTS = Counter(
+    "pipelines_coalesced_requests_total",
+    "Chat completion requests served by an identical request already in flight.",
+    ("pipeline",),
+)
+FILTER_DURATION = Histogram(
+    "pipelines_filter_duration_seconds",
+    "Time spent in a filter's inlet or outlet.",
+    ("filter", "stage"),
+)
+
+
+async def observe_stream(
+    iterator: AsyncIterator, pipeline: str, model: str, start_time: float
+) -> AsyncIterator:
+    """
+    Passes a response stream through while recording time to first chunk,
+    gaps between chunks, chunk count, in-flight streams and total duration.
+    """
+    chunks = CHUNKS.labels(pipeline, model)
+    first_chunk = TIME_TO_FIRST_CHUNK.labels(pipeline, model)
+    gap = INTER_CHUNK_GAP.labels(pipeline, model)
+    streams = STREAMS_IN_FLIGHT.labels(pipeline)
+
+    streams.inc()
+    last_time = None
+    try:
+        async for chunk in iterator:
+            now = time.perf_counter()
+            if last_time is None:
+                first_chunk.observe(now - start_time)
+            else:
+                gap.observe(now - last_time)
+            last_time = now
+            chunks.inc()
+            yield chunk
+    except Exception:
+        REQUEST_ERRORS.labels(pipeline, model, "true").inc()
+        raise
+    finally:
+        streams.dec()
+        REQUEST_DURATION.labels(pipeline, model, "true").observe(
+            time.perf_counter() - start_time
+        )
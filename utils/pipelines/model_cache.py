@@ -0,0 +1,157 @@
+from typing import Callable, Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool
+
+import asyncio
+import inspect
+import logging
+import time
+
+
+def is_error_list(models: Optional[List[dict]]) -> bool:
+    # Manifolds report a failed discovery as a single {"id": "error"} pseudo-model
+    return bool(models) and all(model.get("id") == "error" for model in models)
+
+
+def get_discovery(pipeline) -> Optional[Callable]:
+    """
+    Returns the function that lists a manifold's models: its
+    `discover_pipelines` hook, or a callable `pipelines`. None means the
+    manifold keeps a static `pipelines` list.
+    """
+    if getattr(pipeline, "type", None) != "manifold":
+        return None
+    if hasattr(pipeline, "discover_pipelines"):
+        return pipeline.discover_pipelines
+    if callable(getattr(pipeline, "pipelines", None)):
+        return pipeline.pipelines
+    return None
+
+
+class ModelListCache:
+    """
+    Caches the model lists of manifold pipelines.
+
+    Reading a list never calls the provider: `get()` returns the cached list
+    and `refresh_stale()` revalidates expired entries on background tasks
+    (stale-while-revalidate), concurrently across manifolds and each under a
+    timeout. A failed refresh keeps the last good list instead of replacing
+    it with an error pseudo-model. A manifold without a good list yet is
+    retried after `retry` seconds rather than a full TTL. `on_change` is
+    called whenever a refresh changes a list.
+
+    The TTL and timeout default to `ttl` and `timeout` and can be set per
+    manifold with `pipelines_ttl` and `discovery_timeout` attributes.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        on_change: Callable[[], None],
+        timeout: Optional[float] = None,
+        retry: float = 10,
+    ):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry = retry
+        self.on_change = on_change
+        self._entries: Dict[str, dict] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def get(self, pipeline_id: str, pipeline) -> List[dict]:
+        if get_discovery(pipeline) is None:
+            # Static lists are set by the pipeline itself; only guard against error results
+            models = pipeline.pipelines
+            entry = self._entries.get(pipeline_id)
+            if is_error_list(models) and entry:
+                return entry["models"]
+            self._entries[pipeline_id] = {"models": models, "fetched": time.time()}
+            return models
+
+        entry = self._entries.get(pipeline_id)
+        if entry:
+            return entry["models"]
+        # Not discovered yet: fall back to whatever list the constructor set
+        return pipeline.pipelines if isinstance(pipeline.pipelines, list) else []
+
+    def is_stale(self, pipeline_id: str, pipeline) -> bool:
+        entry = self._entries.get(pipeline_id)
+        if entry is None:
+            return True
+        ttl = getattr(pipeline, "pipelines_ttl", self.ttl)
+        if entry.get("failed"):
+            ttl = min(ttl, self.retry)
+        return time.time() - entry["fetched"] >= ttl
+
+    def refresh_stale(self, pipelines: dict):
+        for pipeline_id, pipeline in pipelines.items():
+            if (
+                get_discovery(pipeline) is None
+                or pipeline_id in self._refreshing
+                or not self.is_stale(pipeline_id, pipeline)
+            ):
+                continue
+
+            task = asyncio.create_task(self.refresh(pipeline_id, pipeline))
+            self._refreshing[pipeline_id] = task
+            task.add_done_callback(
+                lambda task, pipeline_id=pipeline_id: self._done(pipeline_id, task)
+            )
+
+    def _done(self, pipeline_id: str, task: asyncio.Task):
+        # An invalidated refresh may already have been replaced by a newer one
+        if self._refreshing.get(pipeline_id) is task:
+            del self._refreshing[pipeline_id]
+
+    async def refresh(self, pipeline_id: str, pipeline):
+        discover = get_discovery(pipeline)
+        timeout = getattr(pipeline, "discovery_timeout", self.timeout)
+
+        start_time = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(discover):
+                models = await asyncio.wait_for(discover(), timeout=timeout)
+            else:
+                models = await asyncio.wait_for(
+                    run_in_threadpool(discover), timeout=timeout
+                )
+        except asyncio.TimeoutError:
+            print(f"Timed out fetching models for {pipeline_id} after {timeout}s")
+            models = None
+        except Exception as e:
+            print(f"Error fetching models for {pipeline_id}: {e}")
+            models = None
+
+        logging.info(
+            f"Fetched models for {pipeline_id} in {time.perf_counter() - start_time:.2f}s"
+        )
+
+        failed = models is None or is_error_list(models)
+        entry = self._entries.get(pipeline_id)
+        if entry and not entry.get("failed") and failed:
+            # Keep serving the last good list; retry after another TTL
+            entry["fetched"] = time.time()
+            return
+
+        models = models or []
+        self._entries[pipeline_id] = {
+            "models": models,
+            "fetched": time.time(),
+            "failed": failed,
+        }
+        if entry is None or entry["models"] != models:
+            self.on_change()
+
+    def invalidate(self, pipeline_id: str):
+        # The old list keeps being served until the refresh completes
+        if pipeline_id in self._entries:
+            self._entries[pipeline_id]["fetched"] = 0
+        # A refresh still running uses the old valves; its result must not count
+        task = self._refreshing.pop(pipeline_id, None)
+        if task:
+            task.cancel()
+
+    def discard(self, pipeline_id: str):
+        self._entries.pop(pipeline_id, None)
+        task = self._refreshing.pop(pipeline_id, None)
+        if task:
+            task.cancel()
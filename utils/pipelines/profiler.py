@@ -0,0 +1,120 @@
+from collections import Counter
+from typing import Dict, Iterable, Optional, Tuple
+
+import os
+import sys
+import threading
+import time
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread (the event loop, thread pool workers,
+    stream producers) at a fixed interval for a given duration.
+
+    Nothing runs outside `run()`, so the profiler costs nothing while it is
+    not in use. When `filenames` is given, only stacks that pass through one
+    of those source files are kept, e.g. a single pipeline's module.
+    """
+
+    def __init__(self, interval: float = 0.01, filenames: Optional[Iterable] = None):
+        self.interval = interval
+        self.filenames = (
+            {
+                path
+                for filename in filenames
+                for path in (filename, os.path.abspath(filename))
+            }
+            if filenames is not None
+            else None
+        )
+        self.samples: Dict[Tuple[str, ...], int] = Counter()
+        self.duration = 0.0
+        self._labels = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = (
+                f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+            )
+        return label
+
+    def run(self, duration: float) -> Dict[Tuple[str, ...], int]:
+        own_ident = threading.get_ident()
+        start_time = time.perf_counter()
+        deadline = start_time + duration
+
+        while time.perf_counter() < deadline:
+            thread_names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+
+                stack = []
+                matched = self.filenames is None
+                while frame is not None:
+                    code = frame.f_code
+                    if not matched and code.co_filename in self.filenames:
+                        matched = True
+                    stack.append(self._label(code))
+                    frame = frame.f_back
+
+                if matched:
+                    stack.append(thread_names.get(ident, str(ident)))
+                    stack.reverse()
+                    self.samples[tuple(stack)] += 1
+
+            time.sleep(self.interval)
+
+        self.duration = time.perf_counter() - start_time
+        return self.samples
+
+    def collapsed(self) -> str:
+        # One "thread;outer;...;inner count" line per distinct stack, as read by flamegraph.pl
+        return "".join(
+            f"{';'.join(stack)} {count}\n" for stack, count in self.samples.items()
+        )
+
+    def speedscope(self, name: str = "pipelines") -> dict:
+        # One sampled profile per thread in https://www.speedscope.app file format
+        frames = []
+        frame_indexes = {}
+        profiles = {}
+
+        for stack, count in self.samples.items():
+            thread, *labels = stack
+            indexes = []
+            for label in labels:
+                if label not in frame_indexes:
+                    frame_indexes[label] = len(frames)
+                    function, _, location = label.rpartition(" (")
+                    file, _, line = location[:-1].rpartition(":")
+                    frames.append({"name": function, "file": file, "line": int(line)})
+                indexes.append(frame_indexes[label])
+
+            profile = profiles.setdefault(
+                thread,
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": [],
+                    "weights": [],
+                },
+            )
+            profile["samples"].append(indexes)
+            profile["weights"].append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "pipelines",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
@@ -0,0 +1,95 @@
+from types import MappingProxyType
+from typing import Callable, Mapping, Tuple
+
+import threading
+
+
+class PipelineRegistry:
+    """
+    Holds a read-only snapshot of the pipelines table.
+
+    The snapshot is only rebuilt when `rebuild()` is called (load, reload,
+    upload, delete, valves update); request handlers read `snapshot()`, which
+    is a plain attribute access. Every rebuild bumps `generation`.
+
+    Each rebuild also indexes which filters apply to which model, so
+    `filters(model_id)` is a dict lookup instead of a scan over every
+    filter's `valves.pipelines`.
+    """
+
+    def __init__(self, build: Callable[[], dict]):
+        self._build = build
+        self._lock = threading.Lock()
+        self._snapshot: Mapping[str, Mapping] = MappingProxyType({})
+        self._filters: Mapping[str, Tuple[str, ...]] = MappingProxyType({})
+        self._wildcard_filters: Tuple[str, ...] = ()
+        self.generation = 0
+
+    def snapshot(self) -> Mapping[str, Mapping]:
+        return self._snapshot
+
+    def filters(self, model_id: str) -> Tuple[str, ...]:
+        """
+        Returns the ids of the filters attached to `model_id`, in priority order.
+        """
+        return self._filters.get(model_id, self._wildcard_filters)
+
+    def rebuild(self) -> Mapping[str, Mapping]:
+        with self._lock:
+            pipelines = self._build()
+            self._filters, self._wildcard_filters = self._index_filters(pipelines)
+            self._snapshot = MappingProxyType(
+                {
+                    pipeline_id: MappingProxyType(
+                        {**pipeline, "filters": self.filters(pipeline_id)}
+                        if pipeline["type"] != "filter"
+                        else dict(pipeline)
+                    )
+                    for pipeline_id, pipeline in pipelines.items()
+                }
+            )
+            self.generation += 1
+            return self._snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = MappingProxyType({})
+            self._filters = MappingProxyType({})
+            self._wildcard_filters = ()
+            self.generation += 1
+
+    @staticmethod
+    def _index_filters(pipelines: dict):
+        # Lower priority number runs first; sorted() keeps load order for ties
+        filters = sorted(
+            (
+                pipeline
+                for pipeline in pipelines.values()
+                if pipeline["type"] == "filter"
+            ),
+            key=lambda pipeline: pipeline["priority"],
+        )
+        targets = [(filter["id"], set(filter["pipelines"])) for filter in filters]
+
+        model_ids = {
+            pipeline_id
+            for pipeline_id, pipeline in pipelines.items()
+            if pipeline["type"] != "filter"
+        }
+        for _, filter_targets in targets:
+            model_ids.update(filter_targets)
+        model_ids.discard("*")
+
+        index = {
+            model_id: tuple(
+                filter_id
+                for filter_id, filter_targets in targets
+                if "*" in filter_targets or model_id in filter_targets
+            )
+            for model_id in model_ids
+        }
+        wildcard = tuple(
+            filter_id for filter_id, filter_targets in targets if "*" in filter_targets
+        )
+
+        return MappingProxyType(index), wildcard
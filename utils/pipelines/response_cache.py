@@ -0,0 +1,326 @@
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from utils.pipelines.serialization import FastJSONResponse, loads
+from utils.pipelines.stream import CompletionAggregator, StreamMessageEncoder
+from utils.pipelines.sync import write_file_atomic
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+# Request fields that do not change the completion
+IGNORED_FIELDS = {"stream", "stream_options", "user", "chat_id", "title", "metadata"}
+
+
+def normalize_message(message: dict) -> dict:
+    content = message.get("content")
+    if isinstance(content, str):
+        return {**message, "content": content.strip()}
+    return message
+
+
+class CachedCompletion:
+    """The content of a finished completion, replayable as JSON or as SSE."""
+
+    __slots__ = ("parts", "finish_reason", "usage", "expires_at", "size")
+
+    def __init__(
+        self,
+        parts: List[str],
+        finish_reason: Optional[str],
+        usage: Optional[dict],
+        expires_at: float,
+    ):
+        self.parts = parts
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.expires_at = expires_at
+        # Approximate memory footprint, for the cache's size cap
+        self.size = sum(len(part) for part in parts) + 64 * len(parts) + 256
+
+    @classmethod
+    def from_aggregator(
+        cls, aggregator: CompletionAggregator, ttl: float
+    ) -> Optional["CachedCompletion"]:
+        # None for replies not worth caching
+        content = aggregator.content
+        if not content or content.startswith("Error:"):
+            # Example pipes report upstream failures as an "Error: ..." reply; never cache those
+            return None
+        return cls(
+            aggregator.parts,
+            aggregator.finish_reason,
+            aggregator.usage,
+            time.time() + ttl,
+        )
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "parts": self.parts,
+                "finish_reason": self.finish_reason,
+                "usage": self.usage,
+                "expires_at": self.expires_at,
+            }
+        )
+
+    @classmethod
+    def from_json(cls, data: str) -> "CachedCompletion":
+        obj = loads(data)
+        return cls(obj["parts"], obj["finish_reason"], obj["usage"], obj["expires_at"])
+
+    def response(self, model: str, stream: bool):
+        if not stream:
+            aggregator = CompletionAggregator(model)
+            aggregator.parts = self.parts
+            aggregator.finish_reason = self.finish_reason
+            aggregator.usage = self.usage
+            return FastJSONResponse(aggregator.result())
+
+        async def replay():
+            encoder = StreamMessageEncoder(model)
+            for part in self.parts:
+                yield encoder.encode(part)
+            yield encoder.finish
+            yield encoder.done
+
+        return StreamingResponse(replay(), media_type="text/event-stream")
+
+
+class ResponseCache:
+    """
+    Exact-match cache of chat completions, in front of `pipe`.
+
+    Pipelines opt in with a `cache_ttl` attribute (seconds). A request is
+    keyed on its model, its messages with surrounding whitespace stripped,
+    its other parameters (temperature, max_tokens, ...) and the pipeline's
+    valves; `stream` is not part of the key, so a completion cached from a
+    JSON response is replayed as SSE chunks to a streaming request and the
+    other way round. Only requests with `temperature` explicitly 0 are
+    cached, since OpenAI-compatible backends sample when it is left out;
+    pipelines can set `cache_nondeterministic = True` to cache all requests.
+
+    Entries live in memory in LRU order up to `max_bytes`. With `directory`
+    set, entries evicted from memory spill to files there (up to
+    `disk_max_bytes`, oldest first out) and are promoted back on a hit.
+    Memory is only touched from the event loop, so it takes no lock; disk
+    reads and writes run on the thread pool.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        directory: Optional[str] = None,
+        disk_max_bytes: int = 0,
+    ):
+        self.max_bytes = max_bytes
+        self.directory = directory or None
+        self.disk_max_bytes = disk_max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, CachedCompletion]" = OrderedDict()
+        self._disk_bytes: Optional[int] = None
+        self._disk_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, pipeline_id: str, pipeline, body: dict) -> Optional[str]:
+        """
+        Returns the cache key of a request, or None if the pipeline does not
+        cache or the request must not be served from the cache.
+        """
+        if not getattr(pipeline, "cache_ttl", None):
+            return None
+
+        if body.get("temperature") != 0 and not getattr(
+            pipeline, "cache_nondeterministic", False
+        ):
+            return None
+
+        valves = getattr(pipeline, "valves", None)
+        request = {
+            "model": body["model"],
+            "messages": [normalize_message(message) for message in body["messages"]],
+            "params": {
+                key: value
+                for key, value in body.items()
+                if key not in IGNORED_FIELDS and key not in ("model", "messages")
+            },
+            "valves": valves.model_dump() if hasattr(valves, "model_dump") else None,
+        }
+        digest = hashlib.sha256(
+            json.dumps(request, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        # Prefixed with the pipeline id so that a pipeline's entries can be dropped together
+        return f"{pipeline_id}/{digest}"
+
+    async def get(self, key: str) -> Optional[CachedCompletion]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.expired:
+            self._remove(key)
+            entry = None
+
+        if entry is None and self.directory:
+            entry = await run_in_threadpool(self._read_disk, key)
+            if entry is not None:
+                self.put(key, entry)
+
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedCompletion):
+        if key in self._entries:
+            self._remove(key)
+
+        if entry.size > self.max_bytes:
+            self._spill(key, entry)
+            return
+
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.size
+            self.evictions += 1
+            if not evicted.expired:
+                self._spill(evicted_key, evicted)
+
+    def _remove(self, key: str):
+        self.bytes -= self._entries.pop(key).size
+
+    def invalidate(self, pipeline_id: str):
+        """Drops every entry of a pipeline, e.g. after its valves changed."""
+        prefix = f"{pipeline_id}/"
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            self._remove(key)
+
+        if self.directory:
+            path = os.path.join(self.directory, pipeline_id)
+            asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, path, True)
+            with self._disk_lock:
+                self._disk_bytes = None
+
+    def _spill(self, key: str, entry: CachedCompletion):
+        if self.directory:
+            asyncio.get_running_loop().run_in_executor(
+                None, self._write_disk, key, entry
+            )
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[CachedCompletion]:
+        path = self._path(key)
+        try:
+            with open(path, "r") as f:
+                entry = CachedCompletion.from_json(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Dropping unreadable cache file {path}: {e}")
+            entry = None
+
+        if entry is None or entry.expired:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, entry: CachedCompletion):
+        path = self._path(key)
+        data = entry.to_json()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_file_atomic(path, data)
+        except OSError as e:
+            logging.warning(f"Could not write cache file {path}: {e}")
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._disk_usage()
+            else:
+                self._disk_bytes += len(data)
+            if self.disk_max_bytes and self._disk_bytes > self.disk_max_bytes:
+                self._disk_bytes = self._prune_disk()
+
+    def _cache_files(self) -> list:
+        files = []
+        for root, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _disk_usage(self) -> int:
+        return sum(size for _, size, _ in self._cache_files())
+
+    def _prune_disk(self) -> int:
+        # Oldest files out until the disk tier is back under its cap
+        files = sorted(self._cache_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "disk_bytes": self._disk_bytes,
+        }
+
+
+async def collect_stream(
+    iterator: AsyncIterator,
+    model: str,
+    on_complete: Callable[[CompletionAggregator], None],
+) -> AsyncIterator:
+    """
+    Passes the SSE frames of a streaming response through and hands the
+    completion to `on_complete` once the stream has finished. Streams cut
+    short are dropped.
+    """
+    aggregator = CompletionAggregator(model)
+    async for chunk in iterator:
+        for line in chunk.splitlines():
+            if line.startswith("data:"):
+                aggregator.add_data(line[5:].strip())
+        yield chunk
+    on_complete(aggregator)
+
+
+def collect_response(body: bytes, model: str) -> CompletionAggregator:
+    # The completion of a non-streaming JSON response body
+    aggregator = CompletionAggregator(model)
+    aggregator.add(loads(body))
+    return aggregator
@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from utils.pipelines.response_cache import CachedCompletion
+
+import asyncio
+import hashlib
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def get_scope(
+    pipeline_id: str, model: str, messages: List[dict]
+) -> Optional[Tuple[str, str, str]]:
+    """
+    Returns the index a request is looked up in: its pipeline, model and
+    system prompt. Only single-turn requests (a user message, optionally
+    after a system prompt) have a scope, since the answer to a follow-up
+    depends on the whole conversation, not just the last question. Neither
+    have questions with images or other non-text parts, since only their
+    text would be compared.
+    """
+    system = [message for message in messages if message["role"] == "system"]
+    others = [message for message in messages if message["role"] != "system"]
+    if len(others) != 1 or others[0]["role"] != "user":
+        return None
+
+    content = others[0].get("content")
+    if isinstance(content, list) and any(
+        not isinstance(part, dict) or part.get("type") != "text" for part in content
+    ):
+        return None
+
+    system_prompt = str(system[0]["content"]) if system else ""
+    return pipeline_id, model, hashlib.sha256(system_prompt.encode()).hexdigest()
+
+
+class _Index:
+    # Unit-length embeddings of one scope, as the rows of a growable matrix
+
+    def __init__(self, dimensions: int):
+        self.vectors = np.empty((16, dimensions), dtype=np.float32)
+        self.entries: List[CachedCompletion] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, vector, entry: CachedCompletion) -> int:
+        position = len(self.entries)
+        if position == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.empty_like(self.vectors)])
+        self.vectors[position] = vector
+        self.entries.append(entry)
+        return position
+
+    def remove(self, position: int) -> Optional[CachedCompletion]:
+        # Moves the last row into the hole; returns the entry that moved, if any
+        last = len(self.entries) - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            self.entries[position] = moved = self.entries[last]
+        self.entries.pop()
+        return moved
+
+    def search(self, vector) -> Tuple[int, float]:
+        scores = self.vectors[: len(self.entries)] @ vector
+        position = int(np.argmax(scores))
+        return position, float(scores[position])
+
+
+class SemanticCache:
+    """
+    Cache of chat completions keyed on the meaning of the question.
+
+    Sits behind the exact-match `ResponseCache`, for pipelines that set
+    `semantic_cache = True` next to `cache_ttl`. The last user message is
+    embedded with a local sentence-transformers model on the thread pool,
+    and compared by cosine similarity to the questions answered before in
+    the same scope (see `get_scope`). The closest answer is served if its
+    similarity reaches `threshold`, or the pipeline's
+    `semantic_cache_threshold`.
+
+    Each scope is a NumPy matrix searched with a single matrix-vector
+    product. At most `max_entries` answers are kept across all scopes; the
+    least recently used one goes first. Like the response cache, the index
+    is only touched from the event loop.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        threshold: float,
+        max_entries: int,
+        embed: Optional[Callable[[str], "np.ndarray"]] = None,
+    ):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.evictions = 0
+        # Cleared if the embedding model cannot be loaded
+        self.available = np is not None
+        self._embed = embed
+        self._load_lock = asyncio.Lock()
+        self._indexes: Dict[tuple, _Index] = {}
+        # (scope, entry) in least recently used first order -> position in the scope's index
+        self._lru: "OrderedDict[Tuple[tuple, int], int]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def enabled(self, pipeline) -> bool:
+        return self.available and bool(getattr(pipeline, "semantic_cache", False))
+
+    async def embed(self, text: str):
+        """Returns the unit-length embedding of `text`, or None if unavailable."""
+        if self._embed is None:
+            async with self._load_lock:
+                if self._embed is None and self.available:
+                    try:
+                        self._embed = await run_in_threadpool(self._load_model)
+                    except Exception as e:
+                        print(f"Error loading semantic cache model: {e}")
+                        self.available = False
+        if self._embed is None:
+            return None
+
+        vector = await run_in_threadpool(self._embed, text)
+        return np.asarray(vector, dtype=np.float32)
+
+    def _load_model(self) -> Callable[[str], "np.ndarray"]:
+        from sentence_transformers import SentenceTransformer
+
+        logging.info(f"Loading semantic cache model {self.model_name}")
+        model = SentenceTransformer(self.model_name, device="cpu")
+        return lambda text: model.encode(text, normalize_embeddings=True)
+
+    def get(self, scope: tuple, vector, pipeline) -> Optional[CachedCompletion]:
+        index = self._indexes.get(scope)
+        if not index:
+            return None
+
+        position, score = index.search(vector)
+        threshold = getattr(pipeline, "semantic_cache_threshold", self.threshold)
+        if score < threshold:
+            return None
+
+        entry = index.entries[position]
+        if entry.expired:
+            self._remove(scope, position)
+            return None
+
+        self._lru.move_to_end((scope, id(entry)))
+        return entry
+
+    def put(self, scope: tuple, vector, entry: CachedCompletion):
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = _Index(len(vector))
+        position = index.add(vector, entry)
+        self._lru[(scope, id(entry))] = position
+
+        while len(self._lru) > self.max_entries:
+            (evicted_scope, _), evicted_position = next(iter(self._lru.items()))
+            self._remove(evicted_scope, evicted_position)
+            self.evictions += 1
+
+    def _remove(self, scope: tuple, position: int):
+        index = self._indexes[scope]
+        del self._lru[(scope, id(index.entries[position]))]
+        moved = index.remove(position)
+        if moved is not None:
+            self._lru[(scope, id(moved))] = position
+        if not index:
+            del self._indexes[scope]
+
+    def invalidate(self, pipeline_id: str):
+        for scope in [scope for scope in self._indexes if scope[0] == pipeline_id]:
+            index = self._indexes.pop(scope)
+            for entry in index.entries:
+                del self._lru[(scope, id(entry))]
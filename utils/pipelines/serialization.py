@@ -0,0 +1,86 @@
+from typing import Any, Callable
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+
+from utils.pipelines.tracing import TRACER
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    return jsonable_encoder(obj)
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj: Any) -> str:
+        return dumps_bytes(obj).decode("utf-8")
+
+    loads = orjson.loads
+
+else:
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(
+            obj, default=_default, ensure_ascii=False, separators=(",", ":")
+        )
+
+    def dumps_bytes(obj: Any) -> bytes:
+        return dumps(obj).encode("utf-8")
+
+    loads = json.loads
+
+# Scope key of a request body that a middleware has already parsed, so that
+# the route does not parse it again
+PARSED_BODY = "pipelines.parsed_body"
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with orjson when it is installed, stdlib json otherwise.
+
+    Returning it directly from a handler also skips FastAPI's
+    `jsonable_encoder` pass over the content.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bytes(content)
+
+
+class FastJSONRequest(Request):
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            if PARSED_BODY in self.scope:
+                self._json = self.scope[PARSED_BODY]
+            else:
+                with TRACER.start_span("body.parse"):
+                    self._json = loads(await self.body())
+        return self._json
+
+
+class FastJSONRoute(APIRoute):
+    """Route that parses JSON request bodies with `loads`."""
+
+    def get_route_handler(self) -> Callable:
+        route_handler = super().get_route_handler()
+
+        async def fast_json_route_handler(request: Request) -> Response:
+            return await route_handler(FastJSONRequest(request.scope, request.receive))
+
+        return fast_json_route_handler
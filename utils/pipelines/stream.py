@@ -0,0 +1,324 @@
+from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+)
+from concurrent.futures import Executor
+from json.encoder import encode_basestring_ascii
+from pydantic import BaseModel
+
+from utils.pipelines.main import stream_message_template
+from utils.pipelines.serialization import loads
+
+import asyncio
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+
+_DONE = object()
+
+
+class _Raised:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class CancellationEvent(threading.Event):
+    """
+    Set when the client of a streaming completion goes away before the pipe
+    is done.
+
+    Pipes receive it by declaring a `cancel_event` parameter. Besides polling
+    `is_set()` between chunks, they can register cleanup with
+    `add_callback()`, such as the `close` of an upstream `requests` response,
+    which then runs as soon as the client disconnects instead of once the
+    upstream model has finished generating.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def add_callback(self, callback: Callable[[], None]):
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        # Already cancelled
+        callback()
+
+    def set(self):
+        with self._callbacks_lock:
+            if self.is_set():
+                return
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning(f"Error in cancellation callback: {e}")
+
+
+async def iterate_in_thread(
+    iterator: Iterator,
+    maxsize: int = 64,
+    name: str = "pipeline-stream",
+    cancel: Optional[threading.Event] = None,
+    executor: Optional[Executor] = None,
+) -> AsyncGenerator:
+    """
+    Drains a blocking iterator on one dedicated producer thread and yields its
+    items on the event loop.
+
+    Unlike `iterate_in_threadpool`, which schedules a worker-thread round trip
+    for every `next()`, the producer runs the iterator to completion and hands
+    items over through a bounded queue. Once `maxsize` items are waiting the
+    producer blocks until the consumer catches up. If the consumer stops early
+    (e.g. the client disconnected) `cancel` is set, and the producer stops at
+    the next item and closes the iterator.
+
+    The producer runs on `executor` when one is given, else on a new thread,
+    in a copy of the caller's context (so it sees the current tracing span).
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = threading.Semaphore(maxsize)
+    stopped = cancel if cancel is not None else threading.Event()
+    finished = False
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # Event loop is closed, nobody is listening any more
+            stopped.set()
+
+    def produce():
+        try:
+            # The client may have left while this waited for a thread of a bounded pool
+            if stopped.is_set():
+                return
+            for item in iterator:
+                slots.acquire()
+                if stopped.is_set():
+                    break
+                put(item)
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(_Raised(e))
+        finally:
+            if stopped.is_set() and hasattr(iterator, "close"):
+                try:
+                    iterator.close()
+                except Exception:
+                    pass
+
+    context = contextvars.copy_context()
+    if executor is not None:
+        executor.submit(context.run, produce)
+    else:
+        producer = threading.Thread(
+            target=context.run, args=(produce,), name=name, daemon=True
+        )
+        producer.start()
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                finished = True
+                break
+            if isinstance(item, _Raised):
+                finished = True
+                raise item.exc
+            slots.release()
+            yield item
+    finally:
+        if not finished:
+            stopped.set()
+            # Wake the producer in case it is waiting for a free slot
+            slots.release()
+
+
+async def iterate_with_cancel(
+    iterator: AsyncIterator, cancel: threading.Event
+) -> AsyncGenerator:
+    """
+    Yields the items of an async iterator. If the consumer stops early, sets
+    `cancel` and closes the iterator right away rather than on garbage
+    collection.
+    """
+    finished = False
+    try:
+        async for item in iterator:
+            yield item
+        finished = True
+    finally:
+        if not finished:
+            cancel.set()
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+class StreamMessageEncoder:
+    """
+    Renders the `chat.completion.chunk` SSE frames of one stream.
+
+    The id, created timestamp and the JSON around the delta content are
+    computed once per stream, so each chunk only escapes its own content. The
+    output is byte-for-byte what `json.dumps(stream_message_template(...))`
+    produces for the same id and timestamp.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.id = f"{model}-{str(uuid.uuid4())}"
+        self.created = int(time.time())
+
+        marker = "\x00"
+        template = stream_message_template(model, marker)
+        template["id"] = self.id
+        template["created"] = self.created
+        self.prefix, self.suffix = f"data: {json.dumps(template)}\n\n".rsplit(
+            encode_basestring_ascii(marker), 1
+        )
+
+        finish_message = {
+            **template,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {},
+                    "logprobs": None,
+                    "finish_reason": "stop",
+                }
+            ],
+        }
+        self.finish = f"data: {json.dumps(finish_message)}\n\n"
+        self.done = "data: [DONE]"
+
+    def encode(self, content) -> str:
+        if isinstance(content, str):
+            return f"{self.prefix}{encode_basestring_ascii(content)}{self.suffix}"
+        return f"{self.prefix}{json.dumps(content)}{self.suffix}"
+
+
+class CompletionAggregator:
+    """
+    Collects the output of a pipe into a single `chat.completion` object.
+
+    Accepts plain text chunks as well as upstream lines, as str or bytes:
+    OpenAI-style `data: {...}` SSE lines and raw JSON lines (e.g. Ollama's
+    `/api/chat`). Content is joined once at the end, and `usage` and
+    `finish_reason` are kept when the upstream sends them.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.parts = []
+        self.usage: Optional[dict] = None
+        self.finish_reason: Optional[str] = None
+
+    def add(self, chunk):
+        if isinstance(chunk, BaseModel):
+            chunk = chunk.model_dump()
+
+        if isinstance(chunk, dict):
+            self.add_object(chunk)
+            return
+
+        raw = isinstance(chunk, (bytes, bytearray))
+        if raw:
+            chunk = chunk.decode("utf-8")
+        elif not isinstance(chunk, str):
+            chunk = str(chunk)
+
+        if chunk.startswith("data:"):
+            for line in chunk.splitlines():
+                if line.startswith("data:"):
+                    self.add_data(line[5:].strip())
+        elif raw and chunk.lstrip().startswith("{"):
+            self.add_data(chunk)
+        else:
+            self.parts.append(chunk)
+
+    def extend(self, chunks: Iterable):
+        for chunk in chunks:
+            self.add(chunk)
+
+    def add_data(self, data: str):
+        if not data or data == "[DONE]":
+            return
+
+        try:
+            obj = loads(data)
+        except ValueError:
+            self.parts.append(data)
+            return
+
+        if isinstance(obj, dict):
+            self.add_object(obj)
+        else:
+            self.parts.append(data)
+
+    def add_object(self, obj: dict):
+        choices = obj.get("choices")
+        if choices:
+            choice = choices[0]
+            message = choice.get("delta") or choice.get("message") or {}
+            if message.get("content"):
+                self.parts.append(message["content"])
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+        elif isinstance(obj.get("message"), dict):
+            # Ollama native chat format
+            if obj["message"].get("content"):
+                self.parts.append(obj["message"]["content"])
+            if obj.get("done") and "eval_count" in obj:
+                prompt_tokens = obj.get("prompt_eval_count", 0)
+                self.usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": obj["eval_count"],
+                    "total_tokens": prompt_tokens + obj["eval_count"],
+                }
+
+        if obj.get("usage"):
+            self.usage = obj["usage"]
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def result(self) -> dict:
+        completion = {
+            "id": f"{self.model}-{str(uuid.uuid4())}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": self.content,
+                    },
+                    "logprobs": None,
+                    "finish_reason": self.finish_reason or "stop",
+                }
+            ],
+        }
+
+        if self.usage:
+            completion["usage"] = self.usage
+
+        return completion
@@ -0,0 +1,63 @@
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def write_file_atomic(path: str, data: str):
+    # Readers in other processes see either the old or the new file, never a partial one
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class SharedGeneration:
+    """
+    Change counter shared by the worker processes serving one pipelines
+    directory (uvicorn --workers N).
+
+    A worker that changes pipelines or valves on disk calls `bump()`; every
+    worker polls `changed()`, a read of one small file, and reloads when it
+    returns True. Increments are serialized with an exclusive `flock` on a
+    lock file next to the counter (unlocked where fcntl is unavailable).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seen = self.read()
+
+    def read(self) -> int:
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def bump(self) -> int:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                current = self.read()
+                generation = current + 1
+                write_file_atomic(self.path, str(generation))
+            finally:
+                if fcntl:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+        # If another worker bumped since we last looked, leave `seen` behind so
+        # changed() still reports its change
+        if current == self.seen:
+            self.seen = generation
+        return generation
+
+    def changed(self) -> bool:
+        generation = self.read()
+        if generation == self.seen:
+            return False
+        self.seen = generation
+        return True
@@ -0,0 +1,375 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+class Span:
+    """A timed operation of one request, exported once ended."""
+
+    __slots__ = (
+        "tracer",
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start_time",
+        "end_time",
+        "attributes",
+        "error",
+        "_token",
+    )
+
+    def __init__(
+        self,
+        tracer: "Tracer",
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str],
+        attributes: Dict[str, Any],
+        start_time: Optional[int] = None,
+    ):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_id(8)
+        self.parent_id = parent_id
+        self.start_time = start_time or time.time_ns()
+        self.end_time = None
+        self.attributes = attributes
+        self.error = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self, end_time: Optional[int] = None):
+        if self.end_time is None:
+            self.end_time = end_time or time.time_ns()
+            self.tracer.buffer.append(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.error = repr(exc)
+        self.end()
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_time,
+            "end_time_unix_nano": self.end_time,
+            "duration_ms": (self.end_time - self.start_time) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    trace_id = None
+    span_id = None
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def end(self, end_time: Optional[int] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_current_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+class SpanExporter(ABC):
+    """
+    Sink for finished spans; `export` is awaited from the background flush
+    task, and `close` once that task stops.
+    """
+
+    @abstractmethod
+    async def export(self, spans: List[Span]):
+        """Exports a batch of finished spans."""
+
+    async def close(self):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends spans to a file as JSON lines."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, lines: str):
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    async def export(self, spans: List[Span]):
+        lines = "".join(
+            json.dumps(span.to_dict(), default=str) + "\n" for span in spans
+        )
+        await run_in_threadpool(self._write, lines)
+
+
+class OTLPSpanExporter(SpanExporter):
+    """
+    Posts spans to an OpenTelemetry collector over OTLP/HTTP with JSON
+    encoding, over one keep-alive session opened on the first export.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "pipelines"):
+        self.url = f"{endpoint.rstrip('/')}/v1/traces"
+        self.service_name = service_name
+        self._session = None
+
+    @staticmethod
+    def _value(value: Any) -> dict:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _span(self, span: Span) -> dict:
+        return {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+            "name": span.name,
+            "kind": 2 if span.parent_id is None else 1,
+            "startTimeUnixNano": str(span.start_time),
+            "endTimeUnixNano": str(span.end_time),
+            "attributes": [
+                {"key": key, "value": self._value(value)}
+                for key, value in span.attributes.items()
+            ],
+            "status": (
+                {"code": 2, "message": span.error} if span.error else {"code": 1}
+            ),
+        }
+
+    async def export(self, spans: List[Span]):
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+
+        payload = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {
+                                "key": "service.name",
+                                "value": {"stringValue": self.service_name},
+                            }
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "pipelines"},
+                            "spans": [self._span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        async with self._session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def get_exporter(spec: str) -> Optional[SpanExporter]:
+    """Builds an exporter from `file:<path>` or `otlp:<collector url>`."""
+    kind, _, target = spec.partition(":")
+    if kind == "file" and target:
+        return FileSpanExporter(target)
+    if kind == "otlp" and target:
+        return OTLPSpanExporter(target)
+    if spec:
+        logging.warning(f"Unknown tracing exporter: {spec}")
+    return None
+
+
+class Tracer:
+    """
+    Records spans for the current request and exports them in batches.
+
+    Finished spans go to a bounded in-memory buffer (a deque, so spans can be
+    ended from any thread without a lock) that `run_exporter()` flushes to the
+    exporter in the background. The oldest spans are dropped if the exporter
+    falls behind. Without an exporter every call is a no-op.
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter] = None, max_buffer=10000):
+        self.exporter = exporter
+        self.buffer = deque(maxlen=max_buffer)
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def current(self):
+        return _current_span.get() or NOOP_SPAN
+
+    def start_span(
+        self,
+        name: str,
+        traceparent: Optional[str] = None,
+        start_time: Optional[int] = None,
+        **attributes,
+    ):
+        """
+        Starts a span under the current one, or under `traceparent` (a W3C
+        header value) for the root span of a request. End it with `end()` or
+        use it as a context manager to also make it current.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+
+        parent = _current_span.get()
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            match = _TRACEPARENT.match(traceparent or "")
+            trace_id, parent_id = match.groups()[:2] if match else (new_id(16), None)
+        return Span(self, name, trace_id, parent_id, attributes, start_time)
+
+    async def flush(self):
+        spans = []
+        while self.buffer:
+            spans.append(self.buffer.popleft())
+        if spans and self.exporter is not None:
+            try:
+                await self.exporter.export(spans)
+            except Exception as e:
+                print(f"Error exporting {len(spans)} spans: {e}")
+
+    async def run_exporter(self, interval: float = 5.0):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                await self.flush()
+        finally:
+            await self.flush()
+            if self.exporter is not None:
+                await self.exporter.close()
+
+
+TRACER = Tracer()
+
+
+async def trace_stream(
+    iterator: AsyncIterator, start_time: int, **attributes
+) -> AsyncIterator:
+    """
+    Passes a response stream through, recording a `stream.first_chunk` span
+    (from `start_time` to the first chunk) and a `stream` span for the whole
+    stream.
+    """
+    span = TRACER.start_span("stream", **attributes)
+    chunks = 0
+    try:
+        async for chunk in iterator:
+            if chunks == 0:
+                TRACER.start_span(
+                    "stream.first_chunk", start_time=start_time, **attributes
+                ).end()
+            chunks += 1
+            yield chunk
+    except Exception as e:
+        span.error = repr(e)
+        raise
+    finally:
+        span.set_attribute("chunks", chunks)
+        span.end()
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that opens the root span of every HTTP request, continuing
+    the caller's trace when a `traceparent` header is sent. Time spent
+    writing the response to the client is recorded as a `response.write`
+    span.
+    """
+
+    def __init__(self, app: ASGIApp, tracer: Tracer = TRACER):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+
+        with self.tracer.start_span(
+            f"{scope['method']} {scope['path']}",
+            traceparent=traceparent,
+            **{"http.method": scope["method"], "http.target": scope["path"]},
+        ) as root:
+            write_span = None
+            write_time = 0
+
+            async def traced_send(message: Message):
+                nonlocal write_span, write_time
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.status_code", message["status"])
+                    write_span = self.tracer.start_span("response.write")
+
+                # Only the time spent handing bytes to the client, not waiting for the next chunk
+                start_time = time.perf_counter_ns()
+                await send(message)
+                write_time += time.perf_counter_ns() - start_time
+
+            try:
+                await self.app(scope, receive, traced_send)
+            finally:
+                if write_span is not None:
+                    write_span.set_attribute("write_time_ms", write_time / 1e6)
+                    write_span.end()